@@ -38,6 +38,32 @@ class Settings(BaseSettings):
     LEMONSQUEEZY_WEBHOOK_SECRET: str = ""
     # ======================================================
 
+    # --- Packing ---
+    # 启动时拉起装箱进程池并预热内核；只处理认证 / 计费 / 后台流量的进程可设为 False
+    PACKING_PREWARM: bool = True
+    # 装箱进程池的工作进程数；0 表示与 CPU 核数相同
+    PACKING_WORKERS: int = 0
+    # 每个工作进程（以及 API 进程里的先填充会话）计算内核可用的核数；
+    # 0 表示按进程数均分 CPU 核：max(1, 核数 // 进程数)，满载时所有进程的内核线程合计约等于核数。
+    # 两项都显式设置时，进程数 × 核数 应不超过 CPU 核数，否则满载时内核线程互相争抢；
+    # 组合模式（portfolio）同时运行的策略数也不超过这个核数
+    PACKING_NUM_THREADS: int = 0
+    # 装箱结果缓存（按请求内容哈希）：总占用上限（字节）与过期时间（秒）；任一为 0 关闭缓存
+    PACKING_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    PACKING_CACHE_TTL_S: int = 600
+    # 先填充会话（服务端常驻高度场）：所有会话合计的内存上限（字节）与空闲过期时间（秒）
+    PACKING_SESSION_MAX_BYTES: int = 256 * 1024 * 1024
+    PACKING_SESSION_TTL_S: int = 1800
+    # 会话单批的物品件数上限：会话在 API 进程的线程里计算，逐件放置要持有 GIL，
+    # 批次太大会拖慢同进程的其他请求；更大的批次走 /calculate（进程池）并带上 prefilled
+    PACKING_SESSION_MAX_BATCH_UNITS: int = 500
+    # 每个用户同时保留的会话数上限（空会话几乎不占内存，只靠字节上限挡不住无限创建）
+    PACKING_SESSION_MAX_PER_OWNER: int = 8
+    # 物品组检查点（改动后快速重算）：单个结果的上限、所有检查点合计的上限（字节）与过期时间（秒）
+    PACKING_CHECKPOINT_MAX_BYTES: int = 64 * 1024 * 1024
+    PACKING_CHECKPOINT_STORE_BYTES: int = 256 * 1024 * 1024
+    PACKING_CHECKPOINT_TTL_S: int = 1800
+
     model_config = SettingsConfigDict(
         env_file=ENV_PATH,
         env_file_encoding="utf-8",
@@ -1,7 +1,24 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.tools.packing.service import packing_status
 
 router = APIRouter(tags=["health"])
 
 @router.get("/health")
 async def health():
-    return {"status": "ok"}
+    # packing: 装箱进程池的进程数、预热状态与排队 / 计算中的任务数
+    return {"status": "ok", "packing": packing_status()}
+
+@router.get("/ready")
+async def ready():
+    """就绪探针：装箱进程池全部预热完成前返回 503。
+
+    PACKING_PREWARM 关闭的进程不承担装箱流量，直接视为就绪。
+    """
+    from app.core.settings import settings
+
+    status = packing_status()
+    if settings.PACKING_PREWARM and not status["ready"]:
+        return JSONResponse(status_code=503, content={"status": "warming", "packing": status})
+    return {"status": "ready", "packing": status}
@@ -1,21 +1,263 @@
-from fastapi import APIRouter, Depends
-from starlette.concurrency import run_in_threadpool
-from fastapi.responses import JSONResponse
+import json
 
-from app.tools.packing.schemas import PackingRequestV2
-from app.tools.packing.service import run_packing
-from app.services.tool_charge import require_and_charge
+from fastapi import APIRouter, Depends, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import get_db
+from app.deps import get_current_user
+from app.tools.packing.schemas import (
+    PackingBatchRequest,
+    PackingRequestV2,
+    PackingSessionBatch,
+    PackingSessionCreate,
+)
+from app.tools.packing.service import get_packing_executor, get_session_store, run_packing_cached
+from app.services.tool_charge import charge_tool, require_and_charge
 
 router = APIRouter(prefix="/api/v1/tools/packing", tags=["tools:packing"])
 
+# 单次批量请求最多包含的任务数
+MAX_BATCH_JOBS = 1000
+
 @router.post("/calculate")
-async def calculate(request: PackingRequestV2, _: bool = Depends(require_and_charge("packing"))):
+async def calculate(
+    request: PackingRequestV2,
+    http_request: Request,
+    response: Response,
+    _: bool = Depends(require_and_charge("packing")),
+):
+    return await _calculate(request, http_request, response)
+
+
+@router.post("/calculate/compact")
+async def calculate_compact(
+    http_request: Request,
+    response: Response,
+    _: bool = Depends(require_and_charge("packing")),
+):
+    """紧凑请求格式的装箱：物品为 [w, h, d, count] 数组、prefilled 为 [x, z, y, w, h, d] 数组，
+    名称放在名称表里（格式见 compact.py）。数组直接解码成 NumPy 并整批校验，
+    适合上万件 prefilled 的大请求。结果、缓存与响应格式协商与 /calculate 相同。
+    """
+    from app.tools.packing.compact import decode_request
+
+    try:
+        request = decode_request(await http_request.json())
+    except ValueError as e:
+        # 包括请求体不是合法 JSON
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    return await _calculate(request, http_request, response)
+
+
+async def _calculate(request, http_request, response):
+    # numpy / numba 等重依赖只在真正处理装箱请求时导入
+    from app.tools.packing.compact import (
+        BINARY_MEDIA_TYPE,
+        COLUMNAR_MEDIA_TYPE,
+        encode_binary,
+        encode_columnar,
+        negotiate,
+    )
+    from app.tools.packing.packer import PackingCancelled, PackingUnavailable
+
     try:
-        packed_items, unpacked_stats = await run_in_threadpool(run_packing, request)
+        # 在独立进程池里计算（相同请求命中结果缓存 / 共用在途计算）；客户端断开时取消任务
+        (packed_items, unpacked_stats, stats), cache_status = await run_packing_cached(
+            request, is_disconnected=http_request.is_disconnected
+        )
+        # 缓存状态：HIT / COALESCED（与在途的相同请求共用一次计算）/ MISS / BYPASS（缓存关闭）
+        headers = {"X-Packing-Cache": cache_status.upper(), "Vary": "Accept"}
+        response.headers.update(headers)
+
+        # 紧凑格式（按 Accept 协商）：名称表 + 按尺寸分组的扁平 int32 数组，见 compact.py
+        fmt = negotiate(http_request.headers.get("accept"))
+        if fmt is not None:
+            if fmt == "binary":
+                content, media_type = encode_binary(packed_items, unpacked_stats, stats), BINARY_MEDIA_TYPE
+            else:
+                content, media_type = encode_columnar(packed_items, unpacked_stats, stats), COLUMNAR_MEDIA_TYPE
+            return Response(content=content, media_type=media_type, headers=headers)
         return {
             "status": "success",
             "items": packed_items,
-            "unpacked": unpacked_stats
+            "unpacked": unpacked_stats,
+            "stats": stats
         }
+    except PackingCancelled:
+        # 客户端已经断开，这个响应不会被读到
+        return JSONResponse(status_code=499, content={"detail": "请求已取消"})
+    except PackingUnavailable as e:
+        # 工作进程意外退出，进程池正在重建
+        return JSONResponse(status_code=503, content={"detail": str(e)})
     except ValueError as e:
         return JSONResponse(status_code=400, content={"detail": str(e)})
+
+
+def _stream_frame(frame, sse):
+    data = json.dumps(frame, ensure_ascii=False, separators=(",", ":"))
+    if sse:
+        return f"event: {frame['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+@router.post("/calculate/stream")
+async def calculate_stream(
+    request: PackingRequestV2,
+    http_request: Request,
+    _: bool = Depends(require_and_charge("packing")),
+):
+    """流式装箱：边算边分批返回已装好的物品，前端可以立刻开始绘制。
+
+    默认输出 NDJSON（每行一帧）；Accept 含 text/event-stream 时输出 SSE。帧依次为：
+      {"type": "start", "total": 总件数}
+      {"type": "items", "items": [...], "placed": 累计已装件数}   （若干帧）
+      {"type": "done", "unpacked": [...], "stats": {...}, "placed": 已装件数}
+    计算出错（含进程池重建）时以 {"type": "error", "detail": ...} 结束。客户端断开时取消任务。
+    """
+    from app.tools.packing.packer import PackingUnavailable
+
+    sse = "text/event-stream" in http_request.headers.get("accept", "")
+    frames = get_packing_executor().stream(request)
+    try:
+        # 请求本身不合法（如件数超限）时在开始输出之前返回 400
+        _, total = await frames.__anext__()
+    except ValueError as e:
+        await frames.aclose()
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+
+    async def body():
+        placed = 0
+        try:
+            yield _stream_frame({"type": "start", "total": total}, sse)
+            async for frame in frames:
+                if frame[0] == "items":
+                    placed += len(frame[1])
+                    yield _stream_frame({"type": "items", "items": frame[1], "placed": placed}, sse)
+                else:
+                    _, unpacked_stats, stats = frame
+                    yield _stream_frame(
+                        {"type": "done", "unpacked": unpacked_stats, "stats": stats, "placed": placed}, sse
+                    )
+        except (ValueError, PackingUnavailable) as e:
+            yield _stream_frame({"type": "error", "detail": str(e)}, sse)
+        finally:
+            await frames.aclose()
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+
+@router.post("/batch")
+async def calculate_batch(
+    request: PackingBatchRequest,
+    http_request: Request,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """批量装箱：整批只鉴权、查价、扣费一次（按任务数计费），任务分发到各装箱进程并行计算。
+
+    结果按提交顺序返回；单个任务出错（如参数不合法、进程池重建）只影响该任务，
+    进程池重建时该任务的 code 为 503，可以单独重试。
+    """
+    from app.tools.packing.packer import PackingCancelled, PackingUnavailable
+
+    if not request.jobs:
+        return JSONResponse(status_code=400, content={"detail": "批量任务为空"})
+    if len(request.jobs) > MAX_BATCH_JOBS:
+        return JSONResponse(status_code=400, content={"detail": f"批量任务过多（最多 {MAX_BATCH_JOBS} 个）"})
+
+    await charge_tool(db, user.id, "packing", units=len(request.jobs))
+
+    try:
+        outcomes = await get_packing_executor().run_many(
+            request.jobs, is_disconnected=http_request.is_disconnected
+        )
+    except PackingCancelled:
+        return JSONResponse(status_code=499, content={"detail": "请求已取消"})
+
+    results = []
+    for outcome in outcomes:
+        if isinstance(outcome, ValueError):
+            results.append({"status": "error", "detail": str(outcome)})
+        elif isinstance(outcome, PackingUnavailable):
+            results.append({"status": "error", "code": 503, "detail": str(outcome)})
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            packed_items, unpacked_stats, stats = outcome
+            results.append({
+                "status": "success",
+                "items": packed_items,
+                "unpacked": unpacked_stats,
+                "stats": stats
+            })
+    return {"status": "success", "results": results}
+
+
+# --- 先填充会话：高度场常驻服务端，每次只发本批物品，不再重发全部 prefilled ---
+
+def _session_not_found():
+    return JSONResponse(status_code=404, content={"detail": "会话不存在或已过期"})
+
+
+@router.post("/sessions")
+async def create_session(request: PackingSessionCreate, user=Depends(get_current_user)):
+    try:
+        session_id, session = get_session_store().create(user.id, request.bin_size, request.engine)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    return {"status": "success", "session_id": session_id, "session": session.summary()}
+
+
+@router.get("/sessions/{session_id}")
+async def get_session(session_id: str, user=Depends(get_current_user)):
+    session = get_session_store().get(user.id, session_id)
+    if session is None:
+        return _session_not_found()
+    return {"status": "success", "session": session.summary()}
+
+
+@router.post("/sessions/{session_id}/batches")
+async def add_session_batch(
+    session_id: str,
+    request: PackingSessionBatch,
+    user=Depends(get_current_user),
+    _: bool = Depends(require_and_charge("packing")),
+):
+    """在会话已有的摆放上装入一批物品；只返回本批的摆放（计费与 /calculate 相同）。"""
+    store = get_session_store()
+    session = store.get(user.id, session_id)
+    if session is None:
+        return _session_not_found()
+    try:
+        packed_items, unpacked_stats, stats = await store.run(session, session.add_batch, request.items, request.phase)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    return {
+        "status": "success",
+        "items": packed_items,
+        "unpacked": unpacked_stats,
+        "stats": stats
+    }
+
+
+@router.delete("/sessions/{session_id}/batches/last")
+async def pop_session_batch(session_id: str, user=Depends(get_current_user)):
+    """撤销会话中的最后一批，返回被撤销的摆放。"""
+    store = get_session_store()
+    session = store.get(user.id, session_id)
+    if session is None:
+        return _session_not_found()
+    try:
+        removed = await store.run(session, session.pop)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    return {"status": "success", "items": removed, "session": session.summary()}
+
+
+@router.delete("/sessions/{session_id}")
+async def delete_session(session_id: str, user=Depends(get_current_user)):
+    if not get_session_store().remove(user.id, session_id):
+        return _session_not_found()
+    return {"status": "success"}
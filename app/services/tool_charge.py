@@ -10,16 +10,23 @@ from app.models.billing import ToolPricing
 from app.services.points_service import spend_points
 
 
+async def charge_tool(db: AsyncSession, user_id: int, tool_key: str, units: int = 1) -> int:
+    """按工具单价扣 units 次的积分（一次查价、一笔流水），返回扣除的积分。"""
+    pricing = (await db.execute(select(ToolPricing).where(ToolPricing.tool_key == tool_key))).scalar_one_or_none()
+    if not pricing or not pricing.enabled:
+        raise HTTPException(status_code=403, detail="tool_disabled")
+    cost = int(pricing.cost_points or 0) * units
+    note = f"batch x{units}" if units != 1 else None
+    try:
+        await spend_points(db, user_id, cost, reason="tool_usage", ref_type="tool", ref_id=tool_key, note=note)
+    except ValueError:
+        raise HTTPException(status_code=402, detail="insufficient_points")
+    return cost
+
+
 def require_and_charge(tool_key: str):
     async def _dep(user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-        pricing = (await db.execute(select(ToolPricing).where(ToolPricing.tool_key == tool_key))).scalar_one_or_none()
-        if not pricing or not pricing.enabled:
-            raise HTTPException(status_code=403, detail="tool_disabled")
-        cost = int(pricing.cost_points or 0)
-        try:
-            await spend_points(db, user.id, cost, reason="tool_usage", ref_type="tool", ref_id=tool_key)
-        except ValueError:
-            raise HTTPException(status_code=402, detail="insufficient_points")
+        await charge_tool(db, user.id, tool_key)
         return True
 
     return _dep
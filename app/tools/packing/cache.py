@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+
+# 结果占用字节数的估算：每件摆放（name / pos / dim 三个小对象）与每条未装统计的常驻内存
+_ITEM_NBYTES = 400
+_UNPACKED_NBYTES = 300
+_BASE_NBYTES = 1024
+
+
+def request_key(data):
+    """请求的规范化内容哈希：字段默认值 / 大小写 / 等价写法统一后再取 sha256。
+
+    物品顺序保留在键里：排序相同的物品按提交顺序放置，unpacked 也按提交顺序输出，
+    顺序不同的请求结果可能不同。prefilled 的名称不影响摆放、unpacked 与 stats，不进键
+    （紧凑格式也表达不了名称表以外的 prefilled 名称）。
+    """
+    from .compact import request_arrays
+
+    # 标准与紧凑两种请求格式内容相同时键相同
+    item_names, items, _, prefilled, fields = request_arrays(data)
+    tolerance = int(fields.get("tolerance_mm") or 0)
+    canonical = {
+        "bin": [int(v) for v in fields["bin_size"]],
+        "items": item_names,
+        "phase": "prefill" if (fields.get("phase") or "").lower() == "prefill" else "auto",
+        "engine": (fields.get("engine") or "grid").lower(),
+        "tolerance_mm": tolerance if tolerance > 1 else 0,
+        "block_mode": bool(fields.get("block_mode")),
+        "portfolio": bool(fields.get("portfolio")),
+        "time_budget_ms": int(fields.get("time_budget_ms") or 0),
+        "max_bins": int(fields.get("max_bins") or 1),
+    }
+    raw = json.dumps(canonical, ensure_ascii=False, separators=(",", ":"))
+    digest = hashlib.sha256(raw.encode("utf-8"))
+    # 尺寸 / 坐标按数组整块哈希（带上形状，区分两段的分界）
+    for arr in (items, prefilled):
+        digest.update(repr(arr.shape).encode())
+        digest.update(arr.astype("<i8", copy=False).tobytes())
+    return digest.hexdigest()
+
+
+def _result_nbytes(result):
+    items, unpacked, _ = result
+    return _BASE_NBYTES + len(items) * _ITEM_NBYTES + len(unpacked) * _UNPACKED_NBYTES
+
+
+class ResultCache:
+    """装箱结果缓存：按请求内容哈希存 (items, unpacked, stats)。
+
+    - LRU 淘汰，超过 ttl_s 的条目视为过期；总占用（按条目估算的字节数）不超过 max_bytes，
+      单个结果超过 max_bytes 时不缓存。
+    - 同一内容的并发请求只计算一次：后到的请求等待先到的那次计算的结果。
+      先到的请求被取消时，等待者重新查缓存并自己计算，不跟着失败。
+    - 因时间预算提前结束的结果与机器负载有关，不缓存。
+
+    缓存的结果对象被多个响应共用，调用方不能修改。
+    """
+
+    def __init__(self, max_bytes, ttl_s, retry_on=()):
+        self.max_bytes = int(max_bytes)
+        self.ttl_s = float(ttl_s)
+        self.retry_on = tuple(retry_on)
+        self._entries = OrderedDict()  # key -> (expires_at, nbytes, result)
+        self._bytes = 0
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.ttl_s > 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def put(self, key, result):
+        nbytes = _result_nbytes(result)
+        if not self.enabled or nbytes > self.max_bytes or result[2].get("deadline_hit"):
+            return
+        if key in self._entries:
+            self._drop(key)
+        while self._entries and self._bytes + nbytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        self._entries[key] = (time.monotonic() + self.ttl_s, nbytes, result)
+        self._bytes += nbytes
+
+    def _drop(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    async def get_or_compute(self, key, compute):
+        """返回 (result, 状态)，状态为 "hit" / "coalesced" / "miss"。
+
+        compute 为无参协程函数，只在缓存未命中且没有相同的计算在途时调用。
+        """
+        while True:
+            result = self.get(key)
+            if result is not None:
+                self.hits += 1
+                return result, "hit"
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            try:
+                # shield：等待者断开不影响先到请求的那次计算
+                result = await asyncio.shield(pending)
+            except self.retry_on:
+                continue
+            except asyncio.CancelledError:
+                # 先到请求的任务被取消（而不是本请求被取消）：重新来过
+                if pending.cancelled():
+                    continue
+                raise
+            self.coalesced += 1
+            return result, "coalesced"
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            # 没有等待者时也标记为已取出，避免 “exception was never retrieved” 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            self.put(key, result)
+            return result, "miss"
+        finally:
+            del self._inflight[key]
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "inflight": len(self._inflight),
+        }
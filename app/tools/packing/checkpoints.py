@@ -0,0 +1,146 @@
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+
+# 每个检查点的固定开销、每件已装物品（网格单位的 dict）与每次抬高（5 个 int 的 tuple）的估算字节数
+_ENTRY_NBYTES = 256
+_ITEM_NBYTES = 200
+_RECT_NBYTES = 120
+
+
+def group_context(packer_cls, grid, steps, strategy, block, prefilled_rects):
+    """决定“同一组在同一状态下装出同样结果”的全部条件；检查点只在条件相同时复用。"""
+    rects = np.asarray(prefilled_rects, dtype=np.int64).tobytes()
+    return (
+        packer_cls.__name__, tuple(grid), tuple(steps), strategy, bool(block),
+        hashlib.sha256(rects).hexdigest(),
+    )
+
+
+def group_key(item):
+    return item.name, int(item.w), int(item.h), int(item.d), int(item.count)
+
+
+class GroupCheckpoints:
+    """一次装箱按物品组（排序后的顺序）记录的检查点。
+
+    每组装完后记一条：已放置的抬高次数与已装件数、失败记录与计数。不存高度场本身：
+    高度场就是 prefilled 加上各次放置的抬高依次取 max 的结果，所有组共用一份抬高记录
+    （packer.placed_rects），大小与已装件数成正比、与容器面积无关。
+    之后的请求若前 k 组与这里相同（容器、网格、引擎、排序策略、块装、prefilled 也都相同），
+    按顺序重放前 k 组的抬高、接上已装物品，从第 k + 1 组继续装，结果与从头装完全相同。
+
+    总大小超过 max_bytes 后不再记录后面的组（已记录的前缀仍然可用）。
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = int(max_bytes)
+        self.context = None
+        # 各组的 (name, w, h, d, count)
+        self.groups = []
+        # 各组装完后的 (抬高次数, 已装件数, 失败记录, 跳过搜索数, 已放块数)
+        self.entries = []
+        # 已记录的组装出的物品（网格单位，与 packer.items 相同）与放置时的抬高（与 packer.placed_rects 相同）
+        self.items = []
+        self.rects = []
+        self.nbytes = 0
+        self.full = False
+
+    def start(self, context, resume=None, resumed=0):
+        """开始记录；从 resume 续装时先接上它的前 resumed 组（共用同一份数据，不拷贝）。"""
+        self.context = context
+        if resume is not None and resumed:
+            self.groups = resume.groups[:resumed]
+            self.entries = resume.entries[:resumed]
+            n_rects, n_items = self.entries[-1][:2]
+            self.items = resume.items[:n_items]
+            self.rects = resume.rects[:n_rects]
+            self.nbytes = len(self.entries) * _ENTRY_NBYTES + n_items * _ITEM_NBYTES + n_rects * _RECT_NBYTES
+
+    def record(self, packer, group):
+        """记录刚装完的一组。"""
+        if self.full:
+            return
+        n_items = len(packer.items)
+        n_rects = len(packer.placed_rects)
+        new_items = packer.items[len(self.items): n_items]
+        new_rects = packer.placed_rects[len(self.rects): n_rects]
+        nbytes = _ENTRY_NBYTES + len(new_items) * _ITEM_NBYTES + len(new_rects) * _RECT_NBYTES
+        if self.nbytes + nbytes > self.max_bytes:
+            self.full = True
+            return
+        self.groups.append(group)
+        self.entries.append((n_rects, n_items, tuple(packer.failed_shapes), packer.skipped_searches, packer.blocks_placed))
+        self.items.extend(new_items)
+        self.rects.extend(new_rects)
+        self.nbytes += nbytes
+
+    def restore(self, packer, context, groups):
+        """把 packer（已占好 prefilled）恢复到与 groups 相同的最长前缀之后，返回前缀组数。"""
+        if context != self.context:
+            return 0
+        k = 0
+        for mine, theirs in zip(self.groups, groups):
+            if mine != theirs:
+                break
+            k += 1
+        if k == 0:
+            return 0
+        n_rects, n_items, failed, skipped, blocks = self.entries[k - 1]
+        packer.replay(self.rects[:n_rects])
+        packer.items = list(self.items[:n_items])
+        packer.failed_shapes = list(failed)
+        packer.skipped_searches = skipped
+        packer.blocks_placed = blocks
+        return k
+
+
+class CheckpointStore:
+    """本进程内的检查点表：LRU，超过 ttl_s 过期，合计不超过 max_bytes。"""
+
+    def __init__(self, max_bytes, ttl_s):
+        self.max_bytes = int(max_bytes)
+        self.ttl_s = float(ttl_s)
+        self._entries = OrderedDict()  # id -> (expires_at, GroupCheckpoints)
+        self._bytes = 0
+        self.resumed = 0
+        self.evictions = 0
+
+    def get(self, checkpoint_id):
+        entry = self._entries.get(checkpoint_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._drop(checkpoint_id)
+            return None
+        self._entries.move_to_end(checkpoint_id)
+        return entry[1]
+
+    def put(self, trail):
+        """保存一份检查点，返回其 id；放不下时返回 None。"""
+        if not trail.groups or trail.nbytes > self.max_bytes:
+            return None
+        while self._entries and self._bytes + trail.nbytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        checkpoint_id = uuid.uuid4().hex
+        self._entries[checkpoint_id] = (time.monotonic() + self.ttl_s, trail)
+        self._bytes += trail.nbytes
+        return checkpoint_id
+
+    def _drop(self, checkpoint_id):
+        _, trail = self._entries.pop(checkpoint_id)
+        self._bytes -= trail.nbytes
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "resumed": self.resumed,
+            "evictions": self.evictions,
+        }
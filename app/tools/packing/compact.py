@@ -0,0 +1,226 @@
+import json
+import struct
+
+import numpy as np
+
+
+# 紧凑响应格式（按 Accept 协商）：
+#   COLUMNAR_MEDIA_TYPE  列式 JSON
+#   BINARY_MEDIA_TYPE    小端二进制
+# 两者内容相同：名称表 + 按 (名称, 尺寸[, 容器]) 分组的扁平 int32 数组，
+# 同一组的物品几何相同，前端可以直接建一个实例化网格（InstancedMesh）。
+COLUMNAR_MEDIA_TYPE = "application/vnd.packing.columnar+json"
+BINARY_MEDIA_TYPE = "application/vnd.packing.columnar+octet-stream"
+
+BINARY_MAGIC = b"PKC1"
+
+
+def negotiate(accept):
+    """按 Accept 头选响应格式："binary" / "columnar"；都没有时返回 None（普通 JSON）。"""
+    accept = accept or ""
+    if BINARY_MEDIA_TYPE in accept:
+        return "binary"
+    if COLUMNAR_MEDIA_TYPE in accept:
+        return "columnar"
+    return None
+
+
+def _columns(items):
+    """把摆放列表按 (名称, 尺寸[, 容器]) 分组，返回名称表与各列数组（int32）。
+
+    组按第一次出现的顺序排列；组内物品保持装入顺序。
+    """
+    names = []
+    codes = {}
+    for it in items:
+        if it["name"] not in codes:
+            codes[it["name"]] = len(names)
+            names.append(it["name"])
+    multi_bin = bool(items) and "bin" in items[0]
+
+    n = len(items)
+    name_col = np.fromiter((codes[it["name"]] for it in items), dtype=np.int32, count=n)
+    pos = np.array([it["pos"] for it in items], dtype=np.int32).reshape(n, 3)
+    dim = np.array([it["dim"] for it in items], dtype=np.int32).reshape(n, 3)
+    keys = [name_col[:, None], dim]
+    if multi_bin:
+        keys.append(np.fromiter((it["bin"] for it in items), dtype=np.int32, count=n)[:, None])
+    keys = np.hstack(keys)
+
+    uniq, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    # np.unique 按键排序；改成按第一次出现的顺序编号
+    rank = np.empty(len(uniq), dtype=np.int64)
+    rank[np.argsort(first, kind="stable")] = np.arange(len(uniq))
+    group = rank[inverse]
+    order = np.argsort(group, kind="stable")
+    groups = uniq[np.argsort(first, kind="stable")]
+
+    columns = {
+        "group_name": groups[:, 0],
+        "group_dim": groups[:, 1:4].reshape(-1),
+        "group_count": np.bincount(group, minlength=len(groups)).astype(np.int32),
+        "pos": pos[order].reshape(-1),
+    }
+    if multi_bin:
+        columns["group_bin"] = groups[:, 4]
+    return names, columns
+
+
+def encode_columnar(items, unpacked, stats):
+    """列式 JSON：pos 为 [x, z, y, ...]（按组依次排列，每组 group_count[i] 件）。"""
+    names, columns = _columns(items)
+    body = {
+        "status": "success",
+        "format": "columnar",
+        "names": names,
+        **{key: col.tolist() for key, col in columns.items()},
+        "unpacked": unpacked,
+        "stats": stats,
+    }
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_binary(items, unpacked, stats):
+    """二进制：BINARY_MAGIC、uint32 头长度、UTF-8 JSON 头（补齐到 4 字节），然后依次是各 int32 数组。
+
+    头中 arrays 给出数组的名称与长度（按在正文中的先后顺序），其余字段与列式 JSON 相同。
+    """
+    names, columns = _columns(items)
+    header = json.dumps({
+        "format": "binary",
+        "names": names,
+        "arrays": [[key, int(col.size)] for key, col in columns.items()],
+        "unpacked": unpacked,
+        "stats": stats,
+    }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    header += b" " * (-len(header) % 4)
+    parts = [BINARY_MAGIC, struct.pack("<I", len(header)), header]
+    parts += [col.astype("<i4", copy=False).tobytes() for col in columns.values()]
+    return b"".join(parts)
+
+
+# ---------------- 紧凑请求格式 ----------------
+#
+# {
+#   "bin_size": [W, H, D],
+#   "names": ["纸箱A", "纸箱B", ...],               名称表
+#   "items": [[w, h, d, count], ...],               第 i 行的名称为 names[i]
+#   "prefilled": [[x, z, y, w, h, d], ...],         可选
+#   "prefilled_names": [名称下标, ...],              可选，下标指向 names；缺省时名称为 "prefilled"
+#   其余字段（phase、engine、tolerance_mm……）与 PackingRequestV2 相同
+# }
+#
+# 数组直接转成 NumPy，尺寸 / 坐标 / 范围整批校验，不为每件物品建 Pydantic 对象。
+
+_ARRAY_KEYS = ("names", "items", "prefilled", "prefilled_names")
+
+
+class CompactPackingRequest:
+    """紧凑格式解码后的请求：物品与 prefilled 为 int64 数组，其余字段与 PackingRequestV2 相同（作为属性）。"""
+
+    def __init__(self, fields, item_names, item_array, prefilled_names, prefilled_array):
+        self.fields = fields
+        self.item_names = item_names
+        self.item_array = item_array
+        self.prefilled_names = prefilled_names
+        self.prefilled_array = prefilled_array
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+
+# 紧凑请求中每个数的绝对值上限：尺寸 / 坐标 / 件数都远小于它，
+# 求和（总件数、坐标加尺寸）时 int64 也不会溢出
+_VALUE_LIMIT = 2 ** 31 - 1
+
+
+def _int_array(value, cols, label):
+    """转成 (n, cols) 的 int64 数组；元素必须是整数（允许 3.0 这样的整数值浮点），绝对值不超过 _VALUE_LIMIT。"""
+    try:
+        arr = np.asarray(value if value is not None else [])
+    except ValueError:
+        raise ValueError(f"{label} 的每一行必须是 {cols} 个整数")
+    if arr.size == 0:
+        return np.empty((0, cols), dtype=np.int64)
+    if arr.ndim != 2 or arr.shape[1] != cols:
+        raise ValueError(f"{label} 的每一行必须是 {cols} 个整数")
+    if arr.dtype.kind == "f":
+        if not np.isfinite(arr).all() or (arr != np.floor(arr)).any():
+            raise ValueError(f"{label} 中只能是整数")
+    elif arr.dtype.kind not in "iu":
+        # 超出 64 位的整数 NumPy 存成 object，也在这里拒绝
+        raise ValueError(f"{label} 中只能是整数")
+    # 先在原类型（浮点 / uint64）上判断范围，再转换：越界的值转 int64 会回绕成别的数
+    if (arr > _VALUE_LIMIT).any() or (arr < -_VALUE_LIMIT).any():
+        raise ValueError(f"{label} 中的数超出范围（绝对值不超过 {_VALUE_LIMIT}）")
+    return arr.astype(np.int64)
+
+
+def decode_request(payload):
+    """把紧凑格式的 JSON 对象解码为 CompactPackingRequest；不合法时抛出 ValueError。"""
+    from pydantic import ValidationError
+
+    from .packer import _check_prefilled, _raise_first_failure
+    from .schemas import PackingRequestV2
+
+    if not isinstance(payload, dict):
+        raise ValueError("请求体必须是 JSON 对象")
+    # 标量字段借 PackingRequestV2 的定义校验（物品给空列表）
+    options = {k: v for k, v in payload.items() if k not in _ARRAY_KEYS}
+    try:
+        fields = PackingRequestV2.model_validate({**options, "items": []}).model_dump(exclude={"items", "prefilled"})
+    except ValidationError as e:
+        raise ValueError(f"请求参数不合法: {e.errors(include_url=False)}")
+    bin_size = fields["bin_size"]
+    if len(bin_size) != 3 or min(bin_size) <= 0:
+        raise ValueError("容器尺寸必须是 3 个正数")
+
+    names = payload.get("names") or []
+    if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+        raise ValueError("names 必须是字符串列表")
+
+    items = _int_array(payload.get("items"), 4, "items")
+    if len(items) != len(names):
+        raise ValueError("names 与 items 的行数必须相同")
+    _raise_first_failure([
+        ((items[:, :3] <= 0).any(axis=1), "物品尺寸必须为正数"),
+        (items[:, 3] < 0, "物品数量不能为负数"),
+    ])
+
+    prefilled = _int_array(payload.get("prefilled"), 6, "prefilled")
+    index = payload.get("prefilled_names")
+    if index is None:
+        prefilled_names = ["prefilled"] * len(prefilled)
+    else:
+        if not isinstance(index, list):
+            raise ValueError("prefilled_names 必须是下标列表")
+        index = _int_array([[v] for v in index], 1, "prefilled_names")[:, 0]
+        if len(index) != len(prefilled):
+            raise ValueError("prefilled_names 与 prefilled 的行数必须相同")
+        if len(index) and (index.min() < 0 or index.max() >= len(names)):
+            raise ValueError("prefilled_names 中的下标超出 names 范围")
+        prefilled_names = [names[i] for i in index.tolist()]
+    # 与 run_packing 对 prefilled 的校验相同
+    _check_prefilled(prefilled, bin_size)
+
+    return CompactPackingRequest(fields, list(names), items, prefilled_names, prefilled)
+
+
+def request_arrays(data):
+    """任一请求格式的数组形式：(物品名称, 物品 (n, 4), prefilled 名称, prefilled (m, 6), 其余字段)。
+
+    物品列为 w, h, d, count；prefilled 列为 x, z, y, w, h, d（均为 int64）。
+    """
+    if isinstance(data, CompactPackingRequest):
+        return data.item_names, data.item_array, data.prefilled_names, data.prefilled_array, data.fields
+    from .packer import _prefilled_array
+
+    items = list(data.items)
+    prefilled = list(getattr(data, "prefilled", None) or [])
+    item_array = np.array([(it.w, it.h, it.d, it.count) for it in items], dtype=np.int64).reshape(-1, 4)
+    prefilled_array = _prefilled_array(prefilled)
+    return (
+        [it.name for it in items], item_array,
+        [it.name for it in prefilled], prefilled_array,
+        data.model_dump(exclude={"items", "prefilled"}),
+    )
@@ -0,0 +1,397 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+from .compact import request_arrays
+from .kernels import ENGINE
+from .packer import PackingCancelled, PackingUnavailable, run_packing, unit_limit
+from .schemas import ItemModel, PackingRequestV2
+
+
+# 每个任务一块共享内存，全部为 int64：
+#   头部    [0] 取消标志  [1] 状态（见 _QUEUED 等）  [2] 实际装入件数
+#   物品    (物品种数, 4)：w, h, d, count
+#   预填充  (预填充件数, 6)：pos × 3, dim × 3
+#   结果    (总件数, 8)：物品下标, pos × 3, dim × 3, 容器序号
+# 名称等字符串与标量字段很小，随任务参数一起传。
+_HEADER = 3
+_ITEM_COLS = 4
+_PREFILLED_COLS = 6
+_RESULT_COLS = 8
+
+_QUEUED, _RUNNING, _DONE = 0, 1, 2
+
+
+def _layout(n_items, n_prefilled, n_units):
+    """各段的起始下标与总长度：(items_at, prefilled_at, result_at, size)。"""
+    items_at = _HEADER
+    prefilled_at = items_at + n_items * _ITEM_COLS
+    result_at = prefilled_at + n_prefilled * _PREFILLED_COLS
+    return items_at, prefilled_at, result_at, result_at + n_units * _RESULT_COLS
+
+
+class _Job:
+    """父进程一侧的任务：把请求写进共享内存，任务结束后读回结果并释放。"""
+
+    def __init__(self, data, arrived_at=None):
+        # 标准请求与紧凑请求统一成数组
+        names, items, _, prefilled, fields = request_arrays(data)
+        n_units = int(np.clip(items[:, 3], 0, None).sum())
+        # 超限请求不分配共享内存，直接按 run_packing 的规则报错
+        if n_units > unit_limit(data):
+            raise ValueError(f"物品总数过多 ({n_units}个)！")
+
+        items_at, prefilled_at, result_at, size = _layout(len(items), len(prefilled), n_units)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1) * 8)
+        self.buf = np.ndarray((size,), dtype=np.int64, buffer=self.shm.buf)
+        self.buf[:_HEADER] = 0
+        self.buf[items_at:prefilled_at] = items.reshape(-1)
+        self.buf[prefilled_at:result_at] = prefilled.reshape(-1)
+
+        self.names = names
+        self.n_units = n_units
+        self.result_at = result_at
+        self.multi_bin = (getattr(data, "max_bins", None) or 1) > 1
+        self.meta = {
+            "size": size,
+            "layout": (len(items), len(prefilled), n_units),
+            "names": self.names,
+            # 其余请求字段（bin_size、phase、engine……）原样传给子进程
+            "fields": fields,
+        }
+        budget_ms = fields.get("time_budget_ms")
+        if budget_ms and budget_ms > 0:
+            # 时间预算从请求到达本进程起算，在进程池里排队的时间也算在内；
+            # 截止时刻用墙上时钟（time.time()），子进程里换算成自己的 perf_counter
+            start = time.time() if arrived_at is None else arrived_at
+            self.meta["deadline"] = start + budget_ms / 1000
+
+    @property
+    def state(self):
+        return int(self.buf[1])
+
+    def cancel(self):
+        self.buf[0] = 1
+
+    @property
+    def placed(self):
+        """子进程已写回的装入件数（流式模式下随计算增长）。"""
+        return int(self.buf[2])
+
+    def read_items(self, start=0, end=None):
+        n = self.placed if end is None else end
+        rows = self.buf[self.result_at + start * _RESULT_COLS: self.result_at + n * _RESULT_COLS]
+        rows = rows.reshape(n - start, _RESULT_COLS).tolist()
+        if self.multi_bin:
+            return [{"name": self.names[r[0]], "pos": r[1:4], "dim": r[4:7], "bin": r[7]} for r in rows]
+        return [{"name": self.names[r[0]], "pos": r[1:4], "dim": r[4:7]} for r in rows]
+
+    def release(self):
+        # 先丢掉指向共享内存的视图，否则 close 会报 BufferError
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _run_job(shm_name, meta):
+    """子进程入口：从共享内存读请求、装箱、把结果写回共享内存。
+
+    返回未装入统计、stats 与本次记录的检查点（没要求记录时为 None）；
+    装入结果（最多数千行）留在共享内存里。
+    """
+    # 共享内存由父进程负责 unlink。spawn 出的子进程与父进程共用同一个 resource_tracker，
+    # attach 时的重复登记不会导致提前清理。
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        buf = np.ndarray((meta["size"],), dtype=np.int64, buffer=shm.buf)
+        try:
+            if buf[0]:
+                raise PackingCancelled()
+            buf[1] = _RUNNING
+
+            n_items, n_prefilled, n_units = meta["layout"]
+            items_at, prefilled_at, result_at, _ = _layout(n_items, n_prefilled, n_units)
+            item_rows = buf[items_at:prefilled_at].reshape(n_items, _ITEM_COLS).tolist()
+            # 请求已在父进程校验过（FastAPI 的模型校验或紧凑格式的批量校验），这里不再逐件校验；
+            # prefilled 直接以数组交给 run_packing，不逐件建对象
+            data = PackingRequestV2.model_construct(
+                **meta["fields"],
+                items=[
+                    ItemModel.model_construct(name=name, w=w, h=h, d=d, count=count)
+                    for name, (w, h, d, count) in zip(meta["names"], item_rows)
+                ],
+                prefilled=buf[prefilled_at:result_at].reshape(n_prefilled, _PREFILLED_COLS).copy(),
+            )
+
+            # 同名物品取第一个下标；父进程只用它还原名称
+            codes = {}
+            for k, name in enumerate(meta["names"]):
+                codes.setdefault(name, k)
+
+            def write(rows, start):
+                if rows:
+                    out = np.array(
+                        [(codes[it["name"]], *it["pos"], *it["dim"], it.get("bin", 0)) for it in rows], dtype=np.int64
+                    )
+                    at = result_at + start * _RESULT_COLS
+                    buf[at: at + out.size] = out.reshape(-1)
+                # 先写行、再更新件数：父进程读到的件数之前的行都已写好
+                buf[2] = start + len(rows)
+
+            progress = None
+            if meta.get("stream"):
+                # 流式：每批新装好的物品立即写进共享内存，父进程按件数增量读取
+                def progress(rows):
+                    write(rows, int(buf[2]))
+
+            trail = None
+            if meta.get("trail_bytes"):
+                from .checkpoints import GroupCheckpoints
+
+                trail = GroupCheckpoints(meta["trail_bytes"])
+            packed, unpacked, stats = run_packing(
+                data, should_stop=lambda: buf[0] != 0, resume=meta.get("resume"), trail=trail, progress=progress,
+                deadline_at=meta.get("deadline"),
+            )
+            if progress is None:
+                write(packed, 0)
+            return unpacked, stats, trail
+        finally:
+            buf[1] = _DONE
+            del buf
+    finally:
+        shm.close()
+
+
+def _ping():
+    return os.getpid()
+
+
+def _init_worker(threads, warmed, warmup_s):
+    """工作进程初始化：设定内核核数，并按显式签名编译（或从缓存加载）全部内核。
+
+    完成后把已就绪进程数加一，并记录最长的预热耗时，供 /ready 与 /health 使用。
+    """
+    from .kernels import set_kernel_threads
+    from .warmup import warmup
+
+    set_kernel_threads(threads)
+    elapsed = warmup()
+    with warmed.get_lock():
+        warmed.value += 1
+        if elapsed > warmup_s.value:
+            warmup_s.value = elapsed
+
+
+class PackingExecutor:
+    """独立的装箱进程池。
+
+    计算放在单独的工作进程里，不和 API 进程抢 GIL；进程数由配置决定并在启动时预热。
+    请求与装入结果经共享内存传递，不 pickle 成千上万个 dict。
+    客户端断开时：还在排队的任务直接撤销，已开始的任务在下一件物品前看到取消标志后退出。
+    某个工作进程意外退出（如被 OOM killer 杀掉）后，受影响的任务抛出 PackingUnavailable，
+    进程池随即重建并重新预热（期间 ready 为 False）。
+    """
+
+    def __init__(self, workers=0, threads=0, poll_interval=0.2):
+        self.workers = int(workers) if workers and workers > 0 else (os.cpu_count() or 1)
+        # 每个进程的内核核数：未指定时按进程数均分 CPU 核，满载时全部进程的内核线程合计不超过核数
+        # （否则默认的“每核一个进程、每个进程用满全部核”满载时是 核数² 个线程）
+        self.threads = int(threads) if threads and threads > 0 else max(1, (os.cpu_count() or 1) // self.workers)
+        self.poll_interval = poll_interval
+        self._pool = None
+        self._jobs = set()
+        self._warmed = None
+        self._warmup_s = None
+        # 因工作进程意外退出而重建进程池的次数
+        self.restarts = 0
+
+    def start(self):
+        if self._pool is not None:
+            return
+        # numba 的线程层不保证 fork 安全，工作进程一律 spawn
+        ctx = get_context("spawn")
+        self._warmed = ctx.Value("i", 0)
+        self._warmup_s = ctx.Value("d", 0.0)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(self.threads, self._warmed, self._warmup_s),
+        )
+        # 没有空闲进程时每次提交都会新起一个进程：一次提交 workers 个任务即可全部拉起
+        for _ in range(self.workers):
+            self._pool.submit(_ping)
+
+    def shutdown(self):
+        if self._pool is not None:
+            for job in list(self._jobs):
+                job.cancel()
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _rebuild(self, pool):
+        """ProcessPoolExecutor 的某个工作进程死掉后整个池永久不可用：丢掉它，重新拉起并预热。
+
+        同一个坏掉的池只重建一次（其上的其他在途任务也会各自报错）。
+        """
+        if self._pool is not pool:
+            return
+        self.restarts += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        self.start()
+
+    def _submit(self, job, meta):
+        """提交任务，返回 (所用进程池, asyncio future)；进程池已损坏时重建并抛出 PackingUnavailable。"""
+        pool = self._pool
+        try:
+            return pool, asyncio.wrap_future(pool.submit(_run_job, job.shm.name, meta))
+        except BrokenProcessPool:
+            self._rebuild(pool)
+            raise PackingUnavailable("装箱服务正在重启，请稍后重试")
+
+    def _result(self, pool, future):
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._rebuild(pool)
+            raise PackingUnavailable("装箱服务正在重启，请稍后重试")
+
+    @property
+    def ready(self):
+        """全部工作进程都已完成内核预热。"""
+        return self._warmed is not None and self._warmed.value >= self.workers
+
+    def stats(self):
+        """内核实现、进程数、预热状态、排队中（已提交未开始）与计算中的任务数。
+
+        warmup_s 为单个进程最长的内核预热耗时；命中编译缓存时通常不到 1 秒。
+        """
+        states = [job.state for job in self._jobs]
+        return {
+            # 计算内核实现（工作进程与本进程环境相同）
+            "kernel": ENGINE,
+            "workers": self.workers,
+            "started": self._pool is not None,
+            "ready": self.ready,
+            "warmed_workers": self._warmed.value if self._warmed is not None else 0,
+            "warmup_s": round(self._warmup_s.value, 3) if self._warmup_s is not None else None,
+            "queued": sum(1 for s in states if s == _QUEUED),
+            "running": sum(1 for s in states if s == _RUNNING),
+            "restarts": self.restarts,
+        }
+
+    async def run(self, data, is_disconnected=None, arrived_at=None):
+        """提交一次装箱，返回与 run_packing 相同的 (items, unpacked, stats)。
+
+        is_disconnected: 可选的异步回调（如 Request.is_disconnected），
+        返回 True 时取消任务并抛出 PackingCancelled。
+        arrived_at: 请求到达的时刻（time.time()，默认为调用时），time_budget_ms 从这一刻起算。
+        """
+        items, unpacked, stats, _ = await self.run_checkpointed(data, is_disconnected, arrived_at=arrived_at)
+        return items, unpacked, stats
+
+    async def run_checkpointed(self, data, is_disconnected=None, resume=None, trail_bytes=0, arrived_at=None):
+        """同 run，但可以从检查点 resume 续装，并在 trail_bytes > 0 时记录本次的检查点。
+
+        返回 (items, unpacked, stats, 检查点或 None)。检查点随任务参数 / 返回值在进程间传递。
+        """
+        self.start()
+        job = _Job(data, arrived_at)
+        self._jobs.add(job)
+        meta = job.meta
+        if resume is not None or trail_bytes:
+            meta = {**meta, "resume": resume, "trail_bytes": int(trail_bytes)}
+        try:
+            pool, future = self._submit(job, meta)
+            while True:
+                done, _ = await asyncio.wait({future}, timeout=self.poll_interval)
+                if done:
+                    break
+                if is_disconnected is not None and await is_disconnected():
+                    job.cancel()
+                    future.cancel()
+                    raise PackingCancelled()
+            unpacked, stats, trail = self._result(pool, future)
+            return job.read_items(), unpacked, stats, trail
+        finally:
+            self._jobs.discard(job)
+            job.release()
+
+    async def run_many(self, requests, is_disconnected=None):
+        """批量提交互不相关的装箱任务，按顺序返回每个任务的 (items, unpacked, stats) 或异常对象。
+
+        同时在途的任务数限制为进程数的两倍，共享内存占用随之有界；
+        客户端断开检查由整批共用一次轮询，断开时取消全部任务并抛出 PackingCancelled。
+        各任务的 time_budget_ms 都从整批到达时起算（包括等待前面的任务让出名额的时间）。
+        """
+        self.start()
+        arrived_at = time.time()
+        window = asyncio.Semaphore(self.workers * 2)
+        cancelled = asyncio.Event()
+
+        async def stopped():
+            return cancelled.is_set()
+
+        async def one(data):
+            async with window:
+                if cancelled.is_set():
+                    raise PackingCancelled()
+                return await self.run(data, is_disconnected=stopped, arrived_at=arrived_at)
+
+        async def watch():
+            while not await is_disconnected():
+                await asyncio.sleep(self.poll_interval)
+            cancelled.set()
+
+        watcher = asyncio.ensure_future(watch()) if is_disconnected is not None else None
+        try:
+            results = await asyncio.gather(*(one(data) for data in requests), return_exceptions=True)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+        if cancelled.is_set():
+            raise PackingCancelled()
+        return results
+
+    async def stream(self, data, interval=0.05):
+        """流式装箱：异步生成器，依次产出
+
+            ("start", 总件数) → 若干 ("items", 新装好的物品列表) → ("done", unpacked, stats)
+
+        子进程边算边把物品写进共享内存，这里每 interval 秒读一次新增的行，不在内存里攒整份结果。
+        请求不合法时在产出 "start" 之前抛出 ValueError；调用方提前关闭生成器（如客户端断开）时取消任务。
+        """
+        self.start()
+        job = _Job(data)
+        self._jobs.add(job)
+        future = None
+        finished = False
+        try:
+            yield "start", job.n_units
+            pool, future = self._submit(job, {**job.meta, "stream": True})
+            sent = 0
+            while True:
+                done, _ = await asyncio.wait({future}, timeout=interval)
+                n = job.placed
+                if n > sent:
+                    yield "items", job.read_items(sent, n)
+                    sent = n
+                if done:
+                    break
+            unpacked, stats, _ = self._result(pool, future)
+            finished = True
+            yield "done", unpacked, stats
+        finally:
+            if not finished:
+                job.cancel()
+                if future is not None:
+                    future.cancel()
+            self._jobs.discard(job)
+            job.release()
@@ -0,0 +1,122 @@
+import numpy as np
+
+from .packer import SmartPacker
+
+
+class ExtremePointPacker(SmartPacker):
+    """极点（Extreme Points）引擎。
+
+    不再扫描容器内每一个整数坐标，而是维护一组“候选角点”：
+    容器原点、每个已放置箱子的右侧 / 后侧角点，以及它们沿 x / y
+    方向投影到最近的箱子边或墙上的点。搜索只评估这些点，
+    每个点的落点高度 = 与底面重叠的已放置箱子的最大顶面高度。
+
+    因此不分配稠密高度图，单次搜索代价为 O(候选点数 × 已放置箱子数)，
+    只与箱子数量有关、与容器面积无关。
+
+    旋转顺序、选点规则（最低 z，其次 y、x 最小）与输出格式都与 SmartPacker 一致，
+    但只在候选点上选，结果不保证与全格扫描完全相同。
+    """
+
+    # 候选点集合会随放置变化，“此刻放不下”不代表以后也放不下
+    exact_search = False
+
+    @classmethod
+    def height_field_nbytes(cls, bin_w, bin_h, bin_d):
+        # 不分配稠密高度图，内存只随箱子数增长
+        return 0
+
+    def _init_height_field(self):
+        # 已放置箱子的底面矩形与顶面高度：列依次为 x0, x1, y0, y1, top
+        self._boxes = np.empty((64, 5), dtype=np.int64)
+        self._n_boxes = 0
+        self.points = {(0, 0)}
+        self._points_arr = None
+
+    def _reset_height_field(self):
+        # 复用矩形缓冲区，候选点回到只有原点
+        self._n_boxes = 0
+        self.points = {(0, 0)}
+        self._points_arr = None
+
+    def resident_nbytes(self):
+        return self._boxes.nbytes
+
+    def _box_view(self):
+        return self._boxes[: self._n_boxes]
+
+    def _add_point(self, x, y):
+        if 0 <= x < self.bin_w and 0 <= y < self.bin_d and (x, y) not in self.points:
+            self.points.add((x, y))
+            self._points_arr = None
+
+    def _candidate_points(self):
+        if self._points_arr is None:
+            arr = np.array(sorted(self.points), dtype=np.int64).reshape(-1, 2)
+            self._points_arr = arr
+        return self._points_arr
+
+    def find_position(self, rw, rh, rd):
+        rw, rh, rd = int(rw), int(rh), int(rd)
+        pts = self._candidate_points()
+        xs = pts[:, 0]
+        ys = pts[:, 1]
+        ok = (xs + rw <= self.bin_w) & (ys + rd <= self.bin_d)
+        if not ok.any():
+            return -1, -1, -1, False
+        xs = xs[ok]
+        ys = ys[ok]
+
+        boxes = self._box_view()
+        if len(boxes):
+            overlap = (
+                (boxes[None, :, 0] < (xs + rw)[:, None])
+                & (boxes[None, :, 1] > xs[:, None])
+                & (boxes[None, :, 2] < (ys + rd)[:, None])
+                & (boxes[None, :, 3] > ys[:, None])
+            )
+            zs = np.where(overlap, boxes[None, :, 4], 0).max(axis=1)
+        else:
+            zs = np.zeros(len(xs), dtype=np.int64)
+
+        feasible = zs + rh <= self.bin_h
+        if not feasible.any():
+            return -1, -1, -1, False
+        xs, ys, zs = xs[feasible], ys[feasible], zs[feasible]
+        # 选点规则与全格扫描一致：z 最低，其次 y 最小，再次 x 最小
+        best = np.lexsort((xs, ys, zs))[0]
+        return int(xs[best]), int(zs[best]), int(ys[best]), True
+
+    def find_first_position(self, rotations, skip=(), units=1):
+        return self._first_fit_sequential(rotations, skip)
+
+    def occupy(self, x, y, w, d, top):
+        if self._n_boxes == len(self._boxes):
+            self._boxes = np.concatenate([self._boxes, np.empty_like(self._boxes)])
+        self._boxes[self._n_boxes] = (x, x + w, y, y + d, top)
+        self._n_boxes += 1
+
+        # 顶到容器顶的箱子下方的候选点已经不可能再放东西，直接剔除
+        if top >= self.bin_h:
+            dead = [p for p in self.points if x <= p[0] < x + w and y <= p[1] < y + d]
+            if dead:
+                self.points.difference_update(dead)
+                self._points_arr = None
+
+        # 新角点及其投影
+        self._add_point(x + w, y)
+        self._add_point(x, y + d)
+        self._add_point(x + w, self._project_y(x + w, y))
+        self._add_point(self._project_x(x, y + d), y + d)
+
+    def _project_y(self, x, y):
+        """从 (x, y) 沿 -y 方向投影，停在最近的箱子后边或墙上。"""
+        boxes = self._box_view()
+        hit = (boxes[:, 0] <= x) & (boxes[:, 1] > x) & (boxes[:, 3] <= y)
+        return int(boxes[hit, 3].max()) if hit.any() else 0
+
+    def _project_x(self, x, y):
+        """从 (x, y) 沿 -x 方向投影，停在最近的箱子右边或墙上。"""
+        boxes = self._box_view()
+        hit = (boxes[:, 2] <= y) & (boxes[:, 3] > y) & (boxes[:, 1] <= x)
+        return int(boxes[hit, 1].max()) if hit.any() else 0
@@ -0,0 +1,276 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from .kernels import (
+    build_footprint_tables, row_minima, raise_window, first_fit_rotations,
+    pool_max, raise_tiles, pyramid_search, kernel_threads,
+)
+
+
+# 区域最大值表的缓存上限（字节）。单张表大小约等于高度图，
+# 超过上限时按 LRU 淘汰；单张就超限的尺寸不建表，退回逐格扫描。
+FOOTPRINT_CACHE_BYTES = 512 * 1024 * 1024
+# 最多缓存几组表。每次放置都要同步所有缓存表，旧物品组的表很少再用到，
+# 留太多只会拖慢放置。
+FOOTPRINT_CACHE_SETS = 2
+# 一组物品少于这么多件时不值得为它建表（建表本身就要扫一遍整张图），改用金字塔搜索
+TABLE_MIN_UNITS = 8
+# 底面短边小于它时金字塔分块太细，直接逐格扫描
+PYRAMID_MIN_SIDE = 4
+
+
+# 高度图可用的存储类型，从窄到宽
+HEIGHT_DTYPES = (np.uint8, np.uint16, np.uint32)
+
+
+def height_dtype(bin_h):
+    """能表示 0..bin_h 的最窄无符号整数类型（内核按类型各自编译一份）。"""
+    for dt in HEIGHT_DTYPES:
+        if bin_h <= np.iinfo(dt).max:
+            return np.dtype(dt)
+    raise ValueError("容器高度过大！")
+
+
+class _TableSet:
+    """一组底面尺寸的区域最大值表，连续存放在同一块缓冲区里。
+
+    表按需建：先只建前面的姿态，前面的都放不下时才建后面的（见 FootprintIndex.find_first）。
+    """
+
+    def __init__(self, footprints, bin_w, bin_d, dtype):
+        self.footprints = footprints
+        self.rows = np.array([bin_d - d + 1 for _, d in footprints], dtype=np.int64)
+        self.cols = np.array([bin_w - w + 1 for w, _ in footprints], dtype=np.int64)
+        sizes = self.rows * self.cols
+        self.offsets = np.zeros(len(footprints), dtype=np.int64)
+        self.offsets[1:] = np.cumsum(sizes)[:-1]
+        self.nbytes = int(sizes.sum()) * np.dtype(dtype).itemsize
+        self.flat = np.empty(int(sizes.sum()), dtype=dtype)
+        self.views = [
+            self.flat[o: o + r * c].reshape(r, c)
+            for o, r, c in zip(self.offsets, self.rows, self.cols)
+        ]
+        # 每张表逐行的最小值及其最先出现的 x：搜索只看这两列，放置后只重扫受影响的行
+        self.row_offsets = np.zeros(len(footprints), dtype=np.int64)
+        self.row_offsets[1:] = np.cumsum(self.rows)[:-1]
+        self.rowmin = np.empty(int(self.rows.sum()), dtype=dtype)
+        self.rowarg = np.empty(int(self.rows.sum()), dtype=np.int64)
+        self.nbytes += self.rowmin.nbytes + self.rowarg.nbytes
+        self.row_views = [
+            (self.rowmin[o: o + r], self.rowarg[o: o + r])
+            for o, r in zip(self.row_offsets, self.rows)
+        ]
+        self.built = 0
+
+    def ensure(self, height_map, bin_w, bin_d, upto):
+        """保证前 upto 张表已建好；同一批新建的表中深度相同的共用一次滑窗。"""
+        if upto <= self.built:
+            return
+        ws = np.array([w for w, _ in self.footprints], dtype=np.int64)
+        ds = np.array([d for _, d in self.footprints], dtype=np.int64)
+        pending = np.arange(self.built, upto, dtype=np.int64)
+        order = pending[np.argsort(ds[pending], kind="stable")]
+        chunks = kernel_threads()
+        build_footprint_tables(height_map, bin_w, bin_d, ws, ds, order, self.offsets, self.flat, chunks)
+        for k in range(self.built, upto):
+            row_minima(self.views[k], *self.row_views[k], chunks)
+        self.built = upto
+
+
+class FootprintIndex:
+    """高度图上的区域最大值索引。
+
+    对每种底面尺寸 (w, d) 维护一张表：table[y, x] = 以 (x, y) 为左下角、
+    w × d 区域内的最大高度。建表用滑动窗口最大值，复杂度 O(W·D)，
+    与物品底面大小无关；之后每次查询“这个位置放下去的高度”都是 O(1)。
+
+    同一物品的各个旋转姿态作为一组一起建表、一起搜索（深度相同的姿态
+    共用一次滑窗结果），见 find_first。
+
+    高度图只会升高（放置时整块抬到 new_z，且 new_z >= 区域原最大值），
+    因此放置后只需把受影响窗口内的表项抬到 new_z，无需重建；每张表的逐行
+    最小值也随之增量维护，同一组的下一件物品搜索时只看各行最小值。
+    """
+
+    def __init__(self, height_map, bin_w, bin_d, budget_bytes: int = FOOTPRINT_CACHE_BYTES):
+        self.height_map = height_map
+        self.bin_w = int(bin_w)
+        self.bin_d = int(bin_d)
+        self.budget_bytes = int(budget_bytes)
+        self._sets = OrderedDict()
+        self._bytes = 0
+
+    def _table_set(self, footprints):
+        """取一组底面尺寸的表（不存在则建表）；超出缓存上限时返回 None。"""
+        key = tuple(footprints)
+        ts = self._sets.get(key)
+        if ts is not None:
+            self._sets.move_to_end(key)
+            return ts
+
+        nbytes = sum((self.bin_d - d + 1) * (self.bin_w - w + 1) for w, d in key) * self.height_map.itemsize
+        nbytes += sum(self.bin_d - d + 1 for _, d in key) * (self.height_map.itemsize + 8)
+        if nbytes > self.budget_bytes:
+            return None
+        while self._sets and (
+            self._bytes + nbytes > self.budget_bytes or len(self._sets) >= FOOTPRINT_CACHE_SETS
+        ):
+            _, old = self._sets.popitem(last=False)
+            self._bytes -= old.nbytes
+        ts = _TableSet(key, self.bin_w, self.bin_d, self.height_map.dtype)
+        self._sets[key] = ts
+        self._bytes += ts.nbytes
+        return ts
+
+    @property
+    def nbytes(self):
+        """缓存的表实际占用的字节数。"""
+        return self._bytes
+
+    def set_budget(self, budget_bytes):
+        """调整缓存上限；已缓存的表超出新上限时按 LRU 淘汰。"""
+        self.budget_bytes = int(budget_bytes)
+        while self._sets and self._bytes > self.budget_bytes:
+            _, old = self._sets.popitem(last=False)
+            self._bytes -= old.nbytes
+
+    def reset(self):
+        """高度图被清空后调用：保留已分配的表，下次用到时重建内容。"""
+        for ts in self._sets.values():
+            ts.built = 0
+
+    def _fits_base(self, w, d):
+        return 1 <= w <= self.bin_w and 1 <= d <= self.bin_d
+
+    def find(self, it_w, it_h, it_d, bin_h):
+        """与 find_best_pos_numba 语义一致：返回 (best_x, best_z, best_y, found)。
+
+        调用方需保证 it_w、it_d 为正；表超出缓存上限时返回 None，由调用方退回逐格扫描。
+        """
+        if not self._fits_base(it_w, it_d):
+            return -1, -1, -1, False
+        ts = self._table_set([(it_w, it_d)])
+        if ts is None:
+            return None
+        ts.ensure(self.height_map, self.bin_w, self.bin_d, 1)
+        _, bx, bz, by, found = first_fit_rotations(
+            ts.rowmin, ts.rowarg, ts.row_offsets, ts.rows, np.array([bin_h - it_h], dtype=np.int64)
+        )
+        return bx, bz, by, found
+
+    def find_first(self, rotations, bin_h, skip=()):
+        """按给定顺序，找第一个放得下的旋转姿态：返回 (rot_idx, best_x, best_z, best_y, found)。
+
+        rot_idx 为 rotations 中的下标。结果与逐个调用 find 取第一个 found 完全一致，
+        但所有姿态在同一趟扫描中评估。skip 为已知放不下、无需扫描的姿态下标。
+        整组表超出缓存上限时返回 None。
+        """
+        usable = [
+            k for k, (w, _, d) in enumerate(rotations)
+            if k not in skip and self._fits_base(w, d)
+        ]
+        if not usable:
+            return -1, -1, -1, -1, False
+        ts = self._table_set([(rotations[k][0], rotations[k][2]) for k in usable])
+        if ts is None:
+            return None
+        limits = np.array([bin_h - rotations[k][1] for k in usable], dtype=np.int64)
+
+        # 先只用已建好的表（通常就是第一个姿态）；都放不下再建其余的表继续扫。
+        # 前面的姿态都放不下时，后面姿态的胜者与整组一起扫的结果相同。
+        start = 0
+        if ts.built == 0:
+            ts.ensure(self.height_map, self.bin_w, self.bin_d, 1)
+        while start < len(usable):
+            end = ts.built
+            k, bx, bz, by, found = first_fit_rotations(
+                ts.rowmin, ts.rowarg, ts.row_offsets[start:end], ts.rows[start:end], limits[start:end]
+            )
+            if found:
+                return usable[start + k], bx, bz, by, True
+            start = end
+            ts.ensure(self.height_map, self.bin_w, self.bin_d, len(usable))
+        return -1, -1, -1, -1, False
+
+    def raise_rect(self, x, y, w, d, value):
+        """高度图 [x:x+w, y:y+d] 已被抬到 value 后，同步更新所有缓存表。"""
+        for ts in self._sets.values():
+            for (tw, td), table, (rmin, rarg) in zip(ts.footprints[: ts.built], ts.views, ts.row_views):
+                # 只有底面与被抬高矩形重叠的候选位置受影响（“脏矩形”）
+                x0 = max(0, x - tw + 1)
+                y0 = max(0, y - td + 1)
+                x1 = min(table.shape[1], x + w)
+                y1 = min(table.shape[0], y + d)
+                if x0 < x1 and y0 < y1:
+                    raise_window(table, rmin, rarg, x0, x1, y0, y1, value)
+
+
+class HeightPyramid:
+    """高度图的多分辨率最大池化金字塔（第 k 层每格覆盖 2^k × 2^k 个原始格子）。
+
+    放置后按层抬高被覆盖的格子（高度只升不降，取 max 即可），代价约为放置面积的 4/3。
+    搜索时先用粗层给每块候选位置算下界，只在“可能最低”的块里精算，
+    地面大部分已被占满的容器几乎所有块都在粗层就被跳过。见 kernels.pyramid_search。
+    """
+
+    def __init__(self, height_map, bin_w, bin_d):
+        self.height_map = height_map
+        self.bin_w = int(bin_w)
+        self.bin_d = int(bin_d)
+        self.levels = [height_map]
+        for _, _, nw, nd in self._level_shapes(self.bin_w, self.bin_d):
+            self.levels.append(np.zeros((nw, nd), dtype=height_map.dtype))
+        self.rebuild()
+
+    @staticmethod
+    def _level_shapes(bin_w, bin_d):
+        """逐层 (上一层宽, 上一层深, 本层宽, 本层深)。"""
+        w, d = bin_w, bin_d
+        while w > 1 or d > 1:
+            nw, nd = (w + 1) // 2, (d + 1) // 2
+            yield w, d, nw, nd
+            w, d = nw, nd
+
+    @classmethod
+    def nbytes_for(cls, bin_w, bin_d, itemsize):
+        """除第 0 层（即高度图本身）之外各层占用的字节数。"""
+        return sum(nw * nd for _, _, nw, nd in cls._level_shapes(bin_w, bin_d)) * itemsize
+
+    def rebuild(self):
+        """按高度图逐层重新池化（高度图被整块改写后调用）。"""
+        for k, (w, d, _, _) in enumerate(self._level_shapes(self.bin_w, self.bin_d), 1):
+            pool_max(self.levels[k - 1], w, d, self.levels[k])
+
+    def reset(self):
+        """高度图被清空后调用：各层清零。"""
+        for level in self.levels[1:]:
+            level.fill(0)
+
+    def raise_rect(self, x, y, w, d, value):
+        """高度图 [x:x+w, y:y+d] 已被抬到 value 后，同步更新各层。"""
+        if w <= 0 or d <= 0:
+            return
+        for k in range(1, len(self.levels)):
+            raise_tiles(
+                self.levels[k],
+                x >> k, ((x + w - 1) >> k) + 1,
+                y >> k, ((y + d - 1) >> k) + 1,
+                value,
+            )
+
+    def find(self, it_w, it_h, it_d, bin_h):
+        """返回 (best_x, best_z, best_y, found)，与 find_best_pos_numba 结果一致。
+
+        调用方需保证 it_w、it_d 至少为 PYRAMID_MIN_SIDE（更小的底面直接逐格扫描更快）。
+        """
+        if it_w > self.bin_w or it_d > self.bin_d:
+            return -1, -1, -1, False
+        # 选层：格子边长 t 满足 3t - 2 <= 底面短边，保证每块候选的公共底面里有完整格子
+        k = 0
+        while 3 * (2 << k) - 2 <= min(it_w, it_d) and k + 1 < len(self.levels):
+            k += 1
+        return pyramid_search(
+            self.height_map, self.levels[k], 1 << k, self.bin_w, self.bin_d, it_w, it_d, bin_h - it_h,
+            kernel_threads(),
+        )
@@ -0,0 +1,406 @@
+import os
+import threading
+
+import numpy as np
+
+# Numba 在某些环境（例如 coverage 版本冲突、无法安装 wheel 的主机）可能不可用。
+# 为了保证服务能启动，这里做降级：无 numba 时入口内核换成 kernels_numpy 中的
+# 向量化实现（见文件末尾），结果相同。当前使用的实现见 ENGINE。
+try:
+    import numba  # type: ignore
+    from numba import njit, prange  # type: ignore
+except Exception:  # pragma: no cover
+    numba = None
+    prange = range
+
+    def njit(*args, **kwargs):
+        def _wrap(fn):
+            return fn
+        return _wrap
+
+
+def _threadsafe_layer():
+    """可被多个线程同时调用的 Numba 线程层（omp / tbb），都没有时返回 None。
+
+    接口在 run_in_threadpool 里并发调用内核；workqueue 线程层遇到并发调用会直接终止进程，
+    只有它可用时不编译并行版本。两者都可用时选 omp：tbb 线程池若由非主线程第一次启动
+    （会话在 asyncio.to_thread 里、组合模式在线程池里调用内核），任务能算完，
+    但进程退出时会永远挂住。（THREADING_LAYER="threadsafe" 总是先选 tbb，所以这里按名字指定。）
+    """
+    if numba is None:
+        return None
+    for name in ("omp", "tbb"):
+        try:
+            __import__(f"numba.np.ufunc.{name}pool")
+            return name
+        except Exception:
+            continue
+    return None
+
+
+# 内核都以 nogil=True 编译：搜索期间释放 GIL，事件循环和其他请求不会被一次大计算卡住。
+# 可并行的内核再加 parallel=PARALLEL，按 chunks 把行 / 列切块分给多个核。
+_LAYER = _threadsafe_layer()
+PARALLEL = _LAYER is not None
+if PARALLEL and "NUMBA_THREADING_LAYER" not in os.environ:
+    numba.config.THREADING_LAYER = _LAYER
+if PARALLEL and threading.current_thread() is threading.main_thread():
+    # 在主线程上先把线程层启动起来：只有 tbb 可用（或通过环境变量指定了 tbb）时也不会在退出时挂住
+    from numba.np.ufunc.parallel import _launch_threads
+
+    _launch_threads()
+
+
+def set_kernel_threads(n):
+    """设置当前线程后续调用内核时使用的核数（0 或负数表示全部可用核），返回实际核数。
+
+    Numba 的线程数是按调用线程记录的，需在执行装箱的线程里调用。
+    """
+    if not PARALLEL:
+        return 1
+    limit = numba.config.NUMBA_NUM_THREADS
+    n = limit if n <= 0 else min(int(n), limit)
+    numba.set_num_threads(n)
+    return n
+
+
+def kernel_threads():
+    """当前线程调用内核时的并行块数。"""
+    return numba.get_num_threads() if PARALLEL else 1
+
+
+# 计算内核的实现："numba"（编译）或 "numpy"（向量化降级），随 /health 与每次响应上报
+ENGINE = "numba" if numba is not None else "numpy"
+
+INT32_MAX = 2147483647
+
+
+@njit(nogil=True, cache=True)
+def _sliding_max_1d(src, k, out, g, h):
+    """一维滑动窗口最大值（van Herk / Gil-Werman，O(n)，与窗口大小无关）。
+
+    src 长度 n，窗口 k（1 <= k <= n），out 长度 n - k + 1。
+    g / h 为长度 n 的临时缓冲区（块内前缀 / 后缀最大值）。
+    """
+    n = src.shape[0]
+    for i in range(n):
+        if i % k == 0 or src[i] > g[i - 1]:
+            g[i] = src[i]
+        else:
+            g[i] = g[i - 1]
+    for i in range(n - 1, -1, -1):
+        if i == n - 1 or (i + 1) % k == 0 or src[i] > h[i + 1]:
+            h[i] = src[i]
+        else:
+            h[i] = h[i + 1]
+    for i in range(n - k + 1):
+        a = h[i]
+        b = g[i + k - 1]
+        out[i] = a if a > b else b
+
+
+@njit(nogil=True, cache=True)
+def _depth_pass(height_map, bin_d, it_d, cols, x0, x1, row_buf, g, h):
+    """沿 y 方向（深度）求窗口最大值，第 x0..x1-1 列的结果转置存为 cols[y, x]。"""
+    out_d = bin_d - it_d + 1
+    for x in range(x0, x1):
+        _sliding_max_1d(height_map[x, :bin_d], it_d, row_buf[:out_d], g, h)
+        for y in range(out_d):
+            cols[y, x] = row_buf[y]
+
+
+@njit(nogil=True, cache=True, parallel=PARALLEL)
+def build_footprint_tables(height_map, bin_w, bin_d, ws, ds, order, offsets, flat, chunks):
+    """一次性为多个底面尺寸建区域最大值表。
+
+    第 r 张表（底面 ws[r] × ds[r]）存放在 flat[offsets[r]:]，形状为
+    (bin_d - ds[r] + 1, bin_w - ws[r] + 1)，按 [y, x] 存储，与搜索时
+    “先 y 后 x”的扫描顺序一致。order 为按深度排序后的下标：
+    深度相同的表共用同一次 y 方向滑窗结果，只各自再做一次 x 方向滑窗。
+    两趟滑窗各列 / 各行互不相关，按 chunks 切块并行，结果与串行相同。
+    """
+    n = max(bin_w, bin_d)
+    cols = np.empty((1, 1), dtype=flat.dtype)
+    last_d = -1
+    for k in range(order.shape[0]):
+        r = order[k]
+        it_w = ws[r]
+        it_d = ds[r]
+        out_d = bin_d - it_d + 1
+        out_w = bin_w - it_w + 1
+        if it_d != last_d:
+            cols = np.empty((out_d, bin_w), dtype=flat.dtype)
+            for c in prange(chunks):
+                g = np.empty(n, dtype=flat.dtype)
+                h = np.empty(n, dtype=flat.dtype)
+                row_buf = np.empty(bin_d, dtype=flat.dtype)
+                _depth_pass(
+                    height_map, bin_d, it_d, cols,
+                    c * bin_w // chunks, (c + 1) * bin_w // chunks, row_buf, g, h,
+                )
+            last_d = it_d
+        base = offsets[r]
+        for c in prange(chunks):
+            g = np.empty(n, dtype=flat.dtype)
+            h = np.empty(n, dtype=flat.dtype)
+            for y in range(c * out_d // chunks, (c + 1) * out_d // chunks):
+                _sliding_max_1d(cols[y], it_w, flat[base + y * out_w: base + (y + 1) * out_w], g, h)
+
+
+@njit(nogil=True, cache=True)
+def _row_min(table, y, rowmin, rowarg):
+    cols = table.shape[1]
+    best = table[y, 0]
+    arg = 0
+    for x in range(1, cols):
+        if best == 0:
+            break
+        v = table[y, x]
+        if v < best:
+            best = v
+            arg = x
+    rowmin[y] = best
+    rowarg[y] = arg
+
+
+@njit(nogil=True, cache=True, parallel=PARALLEL)
+def row_minima(table, rowmin, rowarg, chunks):
+    """逐行求最小值及其最先出现的位置（每行的“最低前沿”），按 chunks 切块并行。"""
+    rows = table.shape[0]
+    for c in prange(chunks):
+        for y in range(c * rows // chunks, (c + 1) * rows // chunks):
+            _row_min(table, y, rowmin, rowarg)
+
+
+@njit(nogil=True, cache=True)
+def raise_window(table, rowmin, rowarg, x0, x1, y0, y1, value):
+    """把 table[y0:y1, x0:x1] 中小于 value 的值抬高到 value，并维护行最小值。
+
+    只有原行最小值恰好落在被抬高的窗口里、且低于 value 时，该行才需要重扫；
+    窗口外的值没变，原来最先出现的最小值仍然是最小且最先。
+    """
+    for y in range(y0, y1):
+        rescan = rowmin[y] < value and x0 <= rowarg[y] < x1
+        for x in range(x0, x1):
+            if table[y, x] < value:
+                table[y, x] = value
+        if rescan:
+            _row_min(table, y, rowmin, rowarg)
+
+
+@njit(nogil=True, cache=True)
+def first_fit_rotations(rowmin, rowarg, row_offsets, rows, limits):
+    """单趟扫描同时评估多个旋转姿态，返回“按旋转顺序第一个放得下”的姿态及其最低点。
+
+    逐行（y）推进，每行依次看各姿态对应表这一行的最小值（行最小值随放置增量维护，
+    见 raise_window），因此一次搜索是 O(行数) 而不是 O(表大小)。结果与“按顺序逐个
+    调用单姿态搜索、取第一个 found”完全一致：
+      - 一旦第 r 个姿态已找到可行点，排在它后面的姿态不可能胜出，停止扫描；
+      - 排在前面的姿态仍需扫完，以确认它们确实放不下；
+      - 胜出姿态自身扫完（或贴地）后得到的就是它的最低、最先出现的位置。
+
+    返回: (rot_idx, best_x, best_z, best_y, found)
+    """
+    n = rows.shape[0]
+    best_z = np.full(n, INT32_MAX, dtype=np.int64)
+    best_x = np.full(n, -1, dtype=np.int64)
+    best_y = np.full(n, -1, dtype=np.int64)
+    first = n  # 当前已知可行的最靠前姿态
+    max_rows = 0
+    for r in range(n):
+        if limits[r] >= 0 and rows[r] > max_rows:
+            max_rows = rows[r]
+
+    for y in range(max_rows):
+        for r in range(min(n, first + 1)):
+            if y >= rows[r] or limits[r] < 0 or best_z[r] == 0:
+                continue
+            v = rowmin[row_offsets[r] + y]
+            if v < best_z[r]:
+                best_z[r] = v
+                best_x[r] = rowarg[row_offsets[r] + y]
+                best_y[r] = y
+            if best_z[r] <= limits[r] and r < first:
+                first = r
+
+        # 胜出姿态已贴地，且排在前面的姿态都已扫完：结果不会再变
+        if first < n and best_z[first] == 0:
+            done = True
+            for r in range(first):
+                if limits[r] >= 0 and y + 1 < rows[r]:
+                    done = False
+                    break
+            if done:
+                break
+
+    if first < n:
+        return first, best_x[first], best_z[first], best_y[first], True
+    return -1, -1, -1, -1, False
+
+
+@njit(nogil=True, cache=True)
+def pool_max(src, src_w, src_d, dst):
+    """2×2 最大池化：dst[i, j] = max(src[2i:2i+2, 2j:2j+2])（越界部分忽略）。"""
+    for i in range(dst.shape[0]):
+        for j in range(dst.shape[1]):
+            m = src[2 * i, 2 * j]
+            for a in range(2 * i, min(2 * i + 2, src_w)):
+                for b in range(2 * j, min(2 * j + 2, src_d)):
+                    if src[a, b] > m:
+                        m = src[a, b]
+            dst[i, j] = m
+
+
+@njit(nogil=True, cache=True)
+def raise_tiles(level, x0, x1, y0, y1, value):
+    """把金字塔某一层中与 [x0, x1) × [y0, y1)（该层格子坐标）相交的格子抬到 value。"""
+    for i in range(x0, x1):
+        for j in range(y0, y1):
+            if level[i, j] < value:
+                level[i, j] = value
+
+
+@njit(nogil=True, cache=True)
+def _block_exact(height_map, x0, nx, y0, ny, it_w, it_d, out, cols, g, h, line):
+    """精确计算一块候选位置 [x0, x0+nx) × [y0, y0+ny) 的底面最大高度，out[y, x]。"""
+    span_y = ny + it_d - 1
+    for a in range(nx + it_w - 1):
+        for b in range(span_y):
+            line[b] = height_map[x0 + a, y0 + b]
+        _sliding_max_1d(line[:span_y], it_d, cols[:ny, a], g, h)
+    for b in range(ny):
+        _sliding_max_1d(cols[b, :nx + it_w - 1], it_w, out[b, :nx], g, h)
+
+
+@njit(nogil=True, cache=True, parallel=PARALLEL)
+def pyramid_search(height_map, level, t, bin_w, bin_d, it_w, it_d, limit_z, chunks):
+    """由粗到细的精确搜索（结果与 find_best_pos_numba 相同）。
+
+    候选位置按 t × t 分块（t 为所用金字塔层的格子边长，t 不超过底面短边的约 1/3）。
+    同一块内所有候选底面的公共部分（“核心”）至少覆盖一个完整的该层格子，
+    核心内完整格子的最大值就是这一块所有候选高度的下界。
+    按 (下界, y, x) 顺序处理各块：
+      - 下界已高于当前最优（或超出可行高度），其后的块全部跳过；
+      - 下界等于当前最优、但整块位置都排在当前最优之后，也跳过（保持“最先出现”规则）；
+      - 其余块用局部滑动窗口精确计算块内每个候选的高度。
+    各块下界互不相关，按块行切成 chunks 份并行计算；之后的精算按顺序串行，结果确定。
+    返回: (best_x, best_z, best_y, found)
+    """
+    out_w = bin_w - it_w + 1
+    out_d = bin_d - it_d + 1
+    nbx = (out_w + t - 1) // t
+    nby = (out_d + t - 1) // t
+    lw = level.shape[0]
+    ld = level.shape[1]
+
+    lb = np.zeros(nbx * nby, dtype=np.int64)
+    for c in prange(chunks):
+        for by in range(c * nby // chunks, (c + 1) * nby // chunks):
+            y0 = by * t
+            # 核心在 y 方向：[y0 + t - 1, y0 + it_d)，取其中完整的格子
+            j0 = (y0 + t - 1 + t - 1) // t
+            j1 = min((y0 + it_d) // t, ld)
+            for bx in range(nbx):
+                x0 = bx * t
+                i0 = (x0 + t - 1 + t - 1) // t
+                i1 = min((x0 + it_w) // t, lw)
+                m = 0
+                for i in range(i0, i1):
+                    for j in range(j0, j1):
+                        if level[i, j] > m:
+                            m = level[i, j]
+                lb[by * nbx + bx] = m
+
+    order = np.argsort(lb, kind="mergesort")  # 稳定排序：同下界按 (y, x) 块顺序
+
+    n = max(t + it_w, t + it_d)
+    g = np.empty(n, dtype=height_map.dtype)
+    h = np.empty(n, dtype=height_map.dtype)
+    line = np.empty(n, dtype=height_map.dtype)
+    cols = np.empty((t, t + it_w - 1), dtype=height_map.dtype)
+    out = np.empty((t, t), dtype=height_map.dtype)
+
+    best_z = INT32_MAX
+    best_x = -1
+    best_y = -1
+    for k in range(order.shape[0]):
+        idx = order[k]
+        bound = lb[idx]
+        if bound > limit_z or bound > best_z:
+            break
+        by = idx // nbx
+        bx = idx % nbx
+        y0 = by * t
+        x0 = bx * t
+        if bound == best_z and (y0 > best_y or (y0 == best_y and x0 > best_x)):
+            continue
+        nx = min(t, out_w - x0)
+        ny = min(t, out_d - y0)
+        _block_exact(height_map, x0, nx, y0, ny, it_w, it_d, out, cols, g, h, line)
+        for b in range(ny):
+            for a in range(nx):
+                v = out[b, a]
+                y = y0 + b
+                x = x0 + a
+                if v < best_z or (v == best_z and (y < best_y or (y == best_y and x < best_x))):
+                    best_z = v
+                    best_x = x
+                    best_y = y
+
+    if best_x < 0:
+        return -1, -1, -1, False
+    return best_x, best_z, best_y, best_z <= limit_z
+
+
+
+@njit(nogil=True, cache=True)
+def sparse_search(boxes, n, xs, ys, it_w, it_d, limit_z):
+    """稀疏高度场上的精确搜索，结果与逐格扫描（find_best_pos_numba）相同。
+
+    高度场由 boxes[:n] 的矩形 (x0, x1, y0, y1, top) 叠成（其余处为 0）。
+    最优位置的 x 一定是 0 或某个矩形的右边 x1：否则左移一格，底面多覆盖的那一列
+    不会碰到新的矩形，高度不升、位置更靠前。y 同理。因此只需评估 xs × ys
+    （升序、已去掉放不下的候选），代价只与矩形数有关、与容器面积无关。
+    返回: (best_x, best_z, best_y, found)
+    """
+    best_z = INT32_MAX
+    best_x = -1
+    best_y = -1
+    band = np.empty(n, dtype=np.int64)
+    for j in range(ys.shape[0]):
+        y = ys[j]
+        # 先挑出与这一行候选底面在 y 方向重叠的矩形
+        m = 0
+        for b in range(n):
+            if boxes[b, 2] < y + it_d and boxes[b, 3] > y:
+                band[m] = b
+                m += 1
+        for i in range(xs.shape[0]):
+            x = xs[i]
+            z = 0
+            for k in range(m):
+                b = band[k]
+                if boxes[b, 0] < x + it_w and boxes[b, 1] > x and boxes[b, 4] > z:
+                    z = boxes[b, 4]
+                    if z >= best_z:
+                        break
+            if z < best_z:
+                best_z = z
+                best_x = x
+                best_y = y
+                # 按 (y, x) 顺序第一个贴地的位置就是最优
+                if z == 0:
+                    break
+        if best_z == 0:
+            break
+
+    if best_x < 0 or best_z > limit_z:
+        return -1, -1, -1, False
+    return best_x, best_z, best_y, True
+
+if numba is None:  # pragma: no cover
+    print("⚠️ [Backend] 未找到 numba，装箱内核使用 NumPy 向量化实现")
+    from .kernels_numpy import (  # noqa: F811
+        build_footprint_tables, row_minima, raise_window, first_fit_rotations,
+        pool_max, raise_tiles, pyramid_search, sparse_search,
+    )
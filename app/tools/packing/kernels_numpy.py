@@ -0,0 +1,141 @@
+import numpy as np
+
+from .kernels import INT32_MAX
+
+
+# 没有 numba 时使用的向量化实现。接口与 kernels.py 中的同名内核一致（chunks 参数忽略），
+# 结果逐位相同；代价是每次搜索都整块计算，而不是只看增量维护的行最小值 / 金字塔下界。
+
+
+def _sliding_max(a, k, axis):
+    """沿 axis 求窗口为 k 的滑动最大值（van Herk / Gil-Werman，整块向量化）。
+
+    输出在该轴上的长度为 n - k + 1。
+    """
+    a = np.moveaxis(a, axis, -1)
+    n = a.shape[-1]
+    if k == 1:
+        return np.moveaxis(a.copy(), -1, axis)
+    m = -(-n // k) * k
+    pad = np.full(a.shape[:-1] + (m,), np.iinfo(a.dtype).min, dtype=a.dtype)
+    pad[..., :n] = a
+    blocks = pad.reshape(a.shape[:-1] + (m // k, k))
+    # g: 块内前缀最大值；h: 块内后缀最大值
+    g = np.maximum.accumulate(blocks, axis=-1).reshape(pad.shape)
+    h = np.flip(np.maximum.accumulate(np.flip(blocks, -1), axis=-1), -1).reshape(pad.shape)
+    out = np.maximum(h[..., : n - k + 1], g[..., k - 1: n])
+    return np.moveaxis(out, -1, axis)
+
+
+def _footprint_table(height_map, bin_w, bin_d, it_w, it_d, cols=None):
+    """table[y, x] = height_map[x:x+it_w, y:y+it_d] 的最大值。cols 为可复用的深度方向结果。"""
+    if cols is None:
+        cols = _sliding_max(height_map[:bin_w, :bin_d], it_d, axis=1)
+    return _sliding_max(cols, it_w, axis=0).T
+
+
+def build_footprint_tables(height_map, bin_w, bin_d, ws, ds, order, offsets, flat, chunks=1):
+    cols = None
+    last_d = -1
+    for r in order:
+        it_w, it_d = int(ws[r]), int(ds[r])
+        if it_d != last_d:
+            cols = _sliding_max(height_map[:bin_w, :bin_d], it_d, axis=1)
+            last_d = it_d
+        table = _footprint_table(height_map, bin_w, bin_d, it_w, it_d, cols)
+        base = int(offsets[r])
+        flat[base: base + table.size] = table.ravel()
+
+
+def row_minima(table, rowmin, rowarg, chunks=1):
+    arg = table.argmin(axis=1)
+    rowarg[:] = arg
+    rowmin[:] = table[np.arange(table.shape[0]), arg]
+
+
+def raise_window(table, rowmin, rowarg, x0, x1, y0, y1, value):
+    value = int(value)  # 按 Python 整数参与运算，结果保持表的无符号类型
+    arg = rowarg[y0:y1]
+    rescan = np.nonzero((rowmin[y0:y1] < value) & (arg >= x0) & (arg < x1))[0] + y0
+    window = table[y0:y1, x0:x1]
+    np.maximum(window, value, out=window)
+    if rescan.size:
+        rows = table[rescan]
+        arg = rows.argmin(axis=1)
+        rowarg[rescan] = arg
+        rowmin[rescan] = rows[np.arange(rescan.size), arg]
+
+
+def first_fit_rotations(rowmin, rowarg, row_offsets, rows, limits):
+    for r in range(rows.shape[0]):
+        if limits[r] < 0 or rows[r] <= 0:
+            continue
+        o = int(row_offsets[r])
+        seg = rowmin[o: o + int(rows[r])]
+        y = int(seg.argmin())
+        if seg[y] <= limits[r]:
+            return r, int(rowarg[o + y]), int(seg[y]), y, True
+    return -1, -1, -1, -1, False
+
+
+def pool_max(src, src_w, src_d, dst):
+    nw, nd = dst.shape
+    pad = np.full((2 * nw, 2 * nd), np.iinfo(src.dtype).min, dtype=src.dtype)
+    pad[:src_w, :src_d] = src[:src_w, :src_d]
+    dst[:] = pad.reshape(nw, 2, nd, 2).max(axis=(1, 3))
+
+
+def raise_tiles(level, x0, x1, y0, y1, value):
+    value = int(value)
+    tiles = level[x0:x1, y0:y1]
+    np.maximum(tiles, value, out=tiles)
+
+
+def _lowest(table, limit_z):
+    """整表取 (z, y, x) 最小的位置：argmin 在 [y, x] 行优先展开上取第一个最小值。"""
+    k = int(table.argmin())
+    y, x = divmod(k, table.shape[1])
+    z = int(table[y, x])
+    if z > limit_z:
+        return -1, -1, -1, False
+    return x, z, y, True
+
+
+def pyramid_search(height_map, level, t, bin_w, bin_d, it_w, it_d, limit_z, chunks=1):
+    # 向量化实现里整表计算本身就很快，不需要金字塔剪枝
+    return _lowest(_footprint_table(height_map, bin_w, bin_d, it_w, it_d), limit_z)
+
+
+def sparse_search(boxes, n, xs, ys, it_w, it_d, limit_z):
+    boxes = boxes[:n]
+    best = None
+    for y in ys:
+        band = boxes[(boxes[:, 2] < y + it_d) & (boxes[:, 3] > y)]
+        if len(band):
+            hit = (band[None, :, 0] < (xs + it_w)[:, None]) & (band[None, :, 1] > xs[:, None])
+            zs = np.where(hit, band[None, :, 4], 0).max(axis=1)
+        else:
+            zs = np.zeros(len(xs), dtype=np.int64)
+        i = int(zs.argmin())
+        if best is None or zs[i] < best[1]:
+            best = (int(xs[i]), int(zs[i]), int(y))
+            if best[1] == 0:
+                break
+    if best is None or best[1] > limit_z:
+        return -1, -1, -1, False
+    return best[0], best[1], best[2], True
+
+
+def find_best_pos(height_map, bin_w, bin_h, bin_d, it_w, it_h, it_d, chunks=1):
+    """find_best_pos_numba 的向量化版本，返回值相同。"""
+    if bin_w - it_w < 0 or bin_d - it_d < 0:
+        return -1, INT32_MAX, -1, False
+    if it_w <= 0 or it_d <= 0:
+        # 退化的底面：任何位置的落点高度都是 0，第一个位置就是 (0, 0)
+        if it_h <= bin_h:
+            return 0, 0, 0, True
+        return -1, INT32_MAX, -1, False
+    x, z, y, found = _lowest(_footprint_table(height_map, bin_w, bin_d, it_w, it_d), bin_h - it_h)
+    if not found:
+        return -1, INT32_MAX, -1, False
+    return x, z, y, True
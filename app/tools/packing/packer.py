@@ -1,35 +1,33 @@
 import time
+from concurrent.futures import ThreadPoolExecutor
+from math import gcd
 import numpy as np
 
-# Numba 在某些环境（例如 coverage 版本冲突）可能不可用。
-# 为了保证服务能启动，这里做降级：无 numba 时仍可运行，只是速度会慢一些。
-try:
-    from numba import njit  # type: ignore
-except Exception:  # pragma: no cover
-    def njit(*args, **kwargs):
-        def _wrap(fn):
-            return fn
-        return _wrap
+from .kernels import njit, prange, PARALLEL, INT32_MAX, ENGINE, kernel_threads, set_kernel_threads
+from .heightmap import (
+    FootprintIndex, HeightPyramid, height_dtype, FOOTPRINT_CACHE_BYTES, TABLE_MIN_UNITS, PYRAMID_MIN_SIDE,
+)
 
 
 # --- 核心优化：将搜索逻辑全部移入 Numba ---
 # 修复点：函数定义中增加了 it_h 参数
-@njit
-def find_best_pos_numba(height_map, bin_w, bin_h, bin_d, it_w, it_h, it_d):
+# 注：SmartPacker 现在通过 FootprintIndex 搜索；这里保留逐格扫描版本，
+# 作为语义基准，并用于底面为 0 的退化尺寸。
+@njit(nogil=True, cache=True)
+def _find_best_in_rows(height_map, bin_w, bin_h, it_w, it_h, it_d, y_start, y_end):
     """
-    全机器码执行的搜索函数
+    在 y ∈ [y_start, y_end) 的行内逐格搜索
     返回: (best_x, best_z, best_y, found)
     """
-    best_z = 2147483647  # Int32 Max
+    best_z = INT32_MAX
     best_x = -1
     best_y = -1
     found = False
 
     limit_x = bin_w - it_w
-    limit_y = bin_d - it_d
 
     # 1. 机器码级的外层循环 (极速)
-    for y in range(0, limit_y + 1):
+    for y in range(y_start, y_end):
         for x in range(0, limit_x + 1):
 
             # --- 内联的 find_best_z 逻辑 ---
@@ -64,14 +62,231 @@ def find_best_pos_numba(height_map, bin_w, bin_h, bin_d, it_w, it_h, it_d):
     return best_x, best_z, best_y, found
 
 
+@njit(nogil=True, cache=True, parallel=PARALLEL)
+def find_best_pos_numba(height_map, bin_w, bin_h, bin_d, it_w, it_h, it_d, chunks=1):
+    """
+    全机器码执行的搜索函数（释放 GIL，按行切成 chunks 块并行扫描）
+    返回: (best_x, best_z, best_y, found)
+
+    每块各自求块内最低、最先出现的位置，再按块顺序（即 y 顺序）归约、严格小于才替换，
+    因此结果与单线程逐行扫描完全相同，与核数无关。
+    """
+    rows = bin_d - it_d + 1
+    if rows <= 0:
+        return -1, INT32_MAX, -1, False
+    chunks = max(1, min(chunks, rows))
+    xs = np.full(chunks, -1, dtype=np.int64)
+    zs = np.full(chunks, INT32_MAX, dtype=np.int64)
+    ys = np.full(chunks, -1, dtype=np.int64)
+    for c in prange(chunks):
+        bx, bz, by, ok = _find_best_in_rows(
+            height_map, bin_w, bin_h, it_w, it_h, it_d,
+            c * rows // chunks, (c + 1) * rows // chunks,
+        )
+        if ok:
+            xs[c] = bx
+            zs[c] = bz
+            ys[c] = by
+
+    best = -1
+    for c in range(chunks):
+        if xs[c] >= 0 and (best < 0 or zs[c] < zs[best]):
+            best = c
+    if best < 0:
+        return -1, INT32_MAX, -1, False
+    return xs[best], zs[best], ys[best], True
+
+
+if ENGINE == "numpy":  # pragma: no cover
+    # 没有 numba 时上面的逐格扫描会退化成四重 Python 循环，换成向量化实现
+    from .kernels_numpy import find_best_pos as find_best_pos_numba  # noqa: F811
+
+
+class PackingCancelled(Exception):
+    """装箱被中途取消（例如客户端已断开）。"""
+
+
+class PackingUnavailable(Exception):
+    """装箱进程池暂时不可用（工作进程意外退出，正在重建），稍后重试即可。"""
+
+
 class SmartPacker:
-    def __init__(self, bin_w, bin_h, bin_d):
+    # 搜索是否精确：精确搜索下“放不下”是单调的（高度图只升不降），
+    # 可以用失败记录跳过后续必然失败的搜索。只评估部分候选点的引擎应设为 False。
+    exact_search = True
+
+    def __init__(self, bin_w, bin_h, bin_d, scale=(1, 1, 1), index_budget=FOOTPRINT_CACHE_BYTES):
+        """bin_* 为网格单位下的容器尺寸；scale 为各轴（x, 高度, y）一格代表的原始长度。
+
+        add_item_group 接收原始单位的物品尺寸：先旋转、再按所在轴的 scale 缩放，
+        因此各轴步长可以不同（见 calculate_grid_factors）。
+        index_budget 为区域最大值表的缓存上限（字节），见 index_budget()。
+        """
         self.bin_w = int(bin_w)
         self.bin_h = int(bin_h)
         self.bin_d = int(bin_d)
+        self.scale = tuple(int(f) for f in scale)
+        self.index_budget = int(index_budget)
         self.items = []
-        # int32 内存优化
-        self.height_map = np.zeros((self.bin_w + 1, self.bin_d + 1), dtype=np.int32)
+        # 已确认放不下的姿态 (w, h, d)（只保留极小元）。高度图只升不降，
+        # 它们以及三边都不小于它们的姿态以后也永远放不下。跨物品组有效。
+        self.failed_shapes = []
+        # 因失败记录而整次跳过的搜索次数
+        self.skipped_searches = 0
+        # 取消检查：返回 True 时在下一件物品开始前抛出 PackingCancelled
+        self.should_stop = None
+        # 时间预算的截止时刻（time.perf_counter()）；到点后不再放新物品，保留已放好的部分
+        self.deadline = None
+        self.deadline_hit = False
+        # 块装模式下放置的块数
+        self.blocks_placed = 0
+        # 当前容器的序号（多容器装箱时由 next_bin 递增），记入每个已装物品
+        self.bin_index = 0
+        # 检查点：track_changes 为 True 时按顺序记下每次放置的抬高 (x, y, w, d, top)，
+        # 高度场就是 prefilled 加上这些抬高依次取 max 的结果，续装时按顺序重放即可（见 replay）
+        self.track_changes = False
+        self.placed_rects = []
+        # 进度回调：每件（块）物品前以 packer 为参数调用一次，用于流式输出已装好的物品
+        self.on_progress = None
+        self._init_height_field()
+
+    def _init_height_field(self):
+        """分配高度场存储。子类（其他引擎）可以换成别的表示。"""
+        # 按容器高度取最窄的无符号类型（uint8 / uint16 / uint32），内存与缓存占用随之减小
+        self.height_map = np.zeros((self.bin_w + 1, self.bin_d + 1), dtype=height_dtype(self.bin_h))
+        # 区域最大值索引：O(1) 取“底面下最大高度”，放置后增量更新
+        self.index = FootprintIndex(self.height_map, self.bin_w, self.bin_d, self.index_budget)
+        # 最大池化金字塔：不建表时由粗到细搜索
+        self.pyramid = HeightPyramid(self.height_map, self.bin_w, self.bin_d)
+
+    def _reset_height_field(self):
+        """把高度场清空为空容器，复用已分配的缓冲区。"""
+        self.height_map.fill(0)
+        self.index.reset()
+        self.pyramid.reset()
+
+    def set_index_budget(self, budget):
+        """调整区域最大值表的缓存上限（字节）；已缓存的表超出时按 LRU 淘汰。不用表的引擎忽略。"""
+        self.index_budget = int(budget)
+        index = getattr(self, "index", None)
+        if index is not None:
+            index.set_budget(self.index_budget)
+
+    def release_height_field(self):
+        """释放高度场与缓存的表（之后不能再装）；已装物品与各项统计保留。"""
+        self.height_map = self.index = self.pyramid = None
+
+    def next_bin(self):
+        """换一个新的空容器继续装：复用已分配的高度场缓冲区，已装物品保留（带各自的容器序号）。
+
+        失败记录只对当前容器的高度图成立，一并清空。
+        """
+        self.bin_index += 1
+        self.failed_shapes = []
+        self._reset_height_field()
+
+    def find_position(self, rw, rh, rd):
+        """返回 (best_x, best_z, best_y, found)，结果与 find_best_pos_numba 完全一致。"""
+        rw, rh, rd = int(rw), int(rh), int(rd)
+        if rw > 0 and rd > 0:
+            res = self.index.find(rw, rh, rd, self.bin_h)
+            if res is not None:
+                return res
+        # 表超出缓存上限：由粗到细搜索
+        return self._find_without_index(rw, rh, rd)
+
+    def _find_without_index(self, rw, rh, rd):
+        """不建表的搜索：金字塔由粗到细；底面太小（或为 0 的退化尺寸）时逐格扫描。"""
+        rw, rh, rd = int(rw), int(rh), int(rd)
+        if min(rw, rd) >= PYRAMID_MIN_SIDE:
+            return self.pyramid.find(rw, rh, rd, self.bin_h)
+        return find_best_pos_numba(
+            self.height_map, self.bin_w, self.bin_h, self.bin_d, rw, rh, rd, kernel_threads()
+        )
+
+    def find_first_position(self, rotations, skip=(), units=TABLE_MIN_UNITS):
+        """按旋转顺序找第一个放得下的姿态：返回 (rot_idx, best_x, best_z, best_y, found)。
+
+        所有姿态在同一趟扫描中评估（见 FootprintIndex.find_first），
+        胜出姿态与位置和逐个姿态调用 find_position 的结果完全一致。
+        skip 为已知放不下的姿态下标，直接跳过。units 为本组物品件数：
+        件数太少时建表不划算，逐个姿态用金字塔搜索（结果相同）。
+        """
+        if units < TABLE_MIN_UNITS:
+            return self._first_fit_sequential(rotations, skip, self._find_without_index)
+        if all(rw > 0 and rd > 0 for rw, _, rd in rotations):
+            res = self.index.find_first(rotations, self.bin_h, skip)
+            if res is not None:
+                return res
+        return self._first_fit_sequential(rotations, skip)
+
+    def _first_fit_sequential(self, rotations, skip=(), finder=None):
+        finder = finder or self.find_position
+        for k, (rw, rh, rd) in enumerate(rotations):
+            if k in skip:
+                continue
+            bx, bz, by, found = finder(rw, rh, rd)
+            if found:
+                return k, bx, bz, by, True
+        return -1, -1, -1, -1, False
+
+    @classmethod
+    def height_field_nbytes(cls, bin_w, bin_h, bin_d):
+        """该尺寸容器的高度场（高度图 + 金字塔）需要分配的字节数，用于请求前的内存上限检查。
+
+        区域最大值表另有缓存上限，按 index_budget() 从同一个内存上限里分出。
+        """
+        itemsize = height_dtype(bin_h).itemsize
+        return ((bin_w + 1) * (bin_d + 1)) * itemsize + HeightPyramid.nbytes_for(bin_w, bin_d, itemsize)
+
+    def resident_nbytes(self):
+        """高度场当前实际占用的字节数（高度图、金字塔与缓存的区域最大值表）。"""
+        return self.height_field_nbytes(self.bin_w, self.bin_h, self.bin_d) + self.index.nbytes
+
+    def occupy(self, x, y, w, d, top):
+        """把 [x:x+w, y:y+d] 的高度抬到 top（取 max），并同步索引。"""
+        top = int(top)
+        region = self.height_map[x: x + w, y: y + d]
+        np.maximum(region, top, out=region)
+        self.index.raise_rect(x, y, w, d, top)
+        self.pyramid.raise_rect(x, y, w, d, top)
+
+    def _place(self, x, y, w, d, top):
+        """放置一件物品（或一块）：抬高高度场，记录检查点时同时记下这次抬高。"""
+        x, y, w, d, top = int(x), int(y), int(w), int(d), int(top)
+        self.occupy(x, y, w, d, top)
+        if self.track_changes:
+            self.placed_rects.append((x, y, w, d, top))
+
+    def replay(self, rects):
+        """按顺序重放 placed_rects 中记下的抬高，把高度场（含各引擎的附加状态）恢复到当时的样子。"""
+        for rect in rects:
+            self.occupy(*rect)
+        self.placed_rects = list(rects)
+
+    def _should_halt(self):
+        """每件（块）物品前的协作检查：已取消则抛出 PackingCancelled；超出时间预算返回 True。"""
+        if self.on_progress is not None:
+            self.on_progress(self)
+        if self.should_stop is not None and self.should_stop():
+            raise PackingCancelled()
+        if not self.deadline_hit and self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.deadline_hit = True
+        return self.deadline_hit
+
+    def known_to_fail(self, rw, rh, rd):
+        """该姿态是否被某个已失败的姿态支配（三边都不小于它）。"""
+        return any(fw <= rw and fh <= rh and fd <= rd for fw, fh, fd in self.failed_shapes)
+
+    def record_failure(self, rw, rh, rd):
+        if not self.exact_search or self.known_to_fail(rw, rh, rd):
+            return
+        # 新记录支配的旧记录不再需要
+        self.failed_shapes = [
+            (fw, fh, fd) for fw, fh, fd in self.failed_shapes
+            if not (rw <= fw and rh <= fh and rd <= fd)
+        ]
+        self.failed_shapes.append((rw, rh, rd))
 
     def get_rotations(self, w, h, d):
         """几何去重（保序）。
@@ -93,7 +308,21 @@ class SmartPacker:
                 out.append(t)
         return out
 
-    def add_item_group(self, name, w, h, d, count, *, prefer_low_height: bool = False):
+    def grid_rotations(self, w, h, d):
+        """原始单位的旋转姿态按各轴步长换算成网格单位（向上取整，保序、按网格尺寸去重）。
+
+        返回 {网格尺寸: 原始尺寸}（dict 保持插入顺序）。精确缩放时向上取整即整除；
+        容差模式下步长不整除尺寸，向上取整保证物品落在自己的网格块里。
+        """
+        fx, fy, fz = self.scale
+        out = {}
+        for rw, rh, rd in self.get_rotations(w, h, d):
+            t = (-(-rw // fx), -(-rh // fy), -(-rd // fz))
+            if t not in out:
+                out[t] = (rw, rh, rd)
+        return out
+
+    def add_item_group(self, name, w, h, d, count, *, prefer_low_height: bool = False, block: bool = False):
         """批量装入同类物品。
 
         prefer_low_height=True：用于“先填充”阶段。
@@ -102,161 +331,425 @@ class SmartPacker:
           2) 同高度下优先更大的底面面积（rw*rd 更大），视觉更像“铺层”。
 
         注意：仍然会尝试全部旋转；只是顺序变得可控，避免随机竖放。
+
+        block=True：块装模式，见 _add_blocks。
         """
         iw, ih, id_ = int(w), int(h), int(d)
-        rotations = self.get_rotations(iw, ih, id_)
+        real_dims = self.grid_rotations(iw, ih, id_)
+        rotations = list(real_dims)
         if prefer_low_height:
             rotations = sorted(rotations, key=lambda t: (t[1], -(t[0] * t[2])))
+        if block:
+            self._add_blocks(name, rotations, real_dims, int(count))
+            return
+
+        for i in range(count):
+            if self._should_halt():
+                break
+            skip = {k for k, r in enumerate(rotations) if self.known_to_fail(*r)}
+            if len(skip) == len(rotations):
+                # 所有姿态都必然放不下：本组剩余的每一件都不用再搜
+                self.skipped_searches += count - i
+                break
+
+            # 所有旋转一次评估，取旋转顺序中第一个放得下的
+            k, bx, bz, by, found = self.find_first_position(rotations, skip, units=count)
+
+            # 胜出姿态之前的姿态都已确认放不下
+            for j in range(k if found else len(rotations)):
+                if j not in skip:
+                    self.record_failure(*rotations[j])
+
+            if found:
+                rw, rh, rd = rotations[k]
+                new_z = bz + rh
+                # bz 是区域最大高度，new_z >= 区域内任意值，取 max 与直接赋值等价
+                self._place(bx, by, rw, rd, new_z)
+
+                self.items.append({
+                    "name": name,
+                    "pos": [int(bx), int(bz), int(by)],
+                    "dim": [int(rw), int(rh), int(rd)],
+                    # 旋转后的原始尺寸
+                    "size": list(real_dims[(rw, rh, rd)]),
+                    "bin": self.bin_index,
+                })
+
+            # 如果一个也放不下，直接结束（保持原行为：无返回/无异常）
+
+    def _block_shape(self, rw, rh, rd, n):
+        """剩余 n 件、姿态 (rw, rh, rd) 时先尝试的块 (a, b, c)：沿 x、高度、y 的件数，a·b·c <= n。
 
-        for _ in range(count):
+        先堆满高度，再沿 y、最后沿 x 铺开。
+        """
+        b = min(self.bin_h // rh, n)
+        c = min(self.bin_d // rd, max(1, n // b))
+        a = min(self.bin_w // rw, max(1, n // (b * c)))
+        return a, b, c
+
+    def _add_blocks(self, name, rotations, real_dims, count):
+        """块装模式：把 a × b × c 件同姿态物品当成一个整块，一次搜索、一次抬高高度图。
+
+        整块放不下时，把块在占用尺寸最大的方向上减半再试，直到 1 × 1 × 1；
+        单件也放不下才换下一个姿态（姿态优先级与逐件放置相同）。
+        块的失败同样记入失败记录，之后更大的块直接跳过。
+        件数较多时搜索次数从“每件一次”降到“每块几次”，结果仍逐件输出，但摆放与逐件放置不同。
+        """
+        left = count
+        while left > 0:
+            if self._should_halt():
+                break
             placed = False
             for rw, rh, rd in rotations:
-                # 修复点：调用时传入 int(rh)
-                bx, bz, by, found = find_best_pos_numba(
-                    self.height_map, self.bin_w, self.bin_h, self.bin_d,
-                    int(rw), int(rh), int(rd)
-                )
+                if min(self.bin_w // rw, self.bin_h // rh, self.bin_d // rd) <= 0:
+                    continue
+                a, b, c = self._block_shape(rw, rh, rd, left)
+                while True:
+                    bw, bh, bd = a * rw, b * rh, c * rd
+                    if self.known_to_fail(bw, bh, bd):
+                        self.skipped_searches += 1
+                        found = False
+                    else:
+                        _, bx, bz, by, found = self.find_first_position([(bw, bh, bd)], units=1)
+                        if not found:
+                            self.record_failure(bw, bh, bd)
+                    if found:
+                        break
+                    if a == b == c == 1:
+                        break
+                    # 在占用尺寸最大（且还能再分）的方向上减半
+                    extents = [(bw if a > 1 else -1, 0), (bh if b > 1 else -1, 1), (bd if c > 1 else -1, 2)]
+                    axis = max(extents)[1]
+                    if axis == 0:
+                        a //= 2
+                    elif axis == 1:
+                        b //= 2
+                    else:
+                        c //= 2
+                if not found:
+                    continue
+
+                self._place(bx, by, bw, bd, bz + bh)
+                self.blocks_placed += 1
+                size = list(real_dims[(rw, rh, rd)])
+                for j in range(b):
+                    for k in range(c):
+                        for i in range(a):
+                            self.items.append({
+                                "name": name,
+                                "pos": [int(bx + i * rw), int(bz + j * rh), int(by + k * rd)],
+                                "dim": [int(rw), int(rh), int(rd)],
+                                "size": size,
+                                "bin": self.bin_index,
+                            })
+                left -= a * b * c
+                placed = True
+                break
+            if not placed:
+                break
+
+
+def _gcd_all(values):
+    g = 0
+    for v in values:
+        g = gcd(g, int(v))
+    return g
+
+
+def _prefilled_array(prefilled):
+    """prefilled 转成 (m, 6) 的 int64 数组，列为 x, z, y, w, h, d（mm）。"""
+    if isinstance(prefilled, np.ndarray):
+        return prefilled.astype(np.int64, copy=False).reshape(-1, 6)
+    if any(len(it.pos) != 3 or len(it.dim) != 3 for it in prefilled):
+        raise ValueError("prefilled 物品的 pos / dim 必须各为 3 个数")
+    return np.array([(*it.pos, *it.dim) for it in prefilled], dtype=np.int64).reshape(-1, 6)
+
+
+def calculate_grid_factors(bin_size, items, prefilled=()):
+    """精确网格缩放：各轴步长取该轴上所有尺寸与坐标的最大公约数。
+
+    物品可以任意旋转，所以每个物品的三边都参与三个轴；容器与 prefilled
+    是固定的，只参与各自的轴。这样所有可能的放置坐标都落在网格上，
+    结果与 1mm 网格完全一致，但网格尽可能粗：内存与搜索量随步长平方下降。
+
+    prefilled 可以是物品列表，也可以是 _prefilled_array 的数组。
+    返回 (fx, fy, fz)，分别对应 x（宽）、高度、y（深）。
+    """
+    item_g = _gcd_all(v for it in items for v in (it.w, it.h, it.d))
+    prefilled = _prefilled_array(prefilled)
+    factors = []
+    for axis in range(3):
+        # prefilled 可能有上万件，整列一次求公约数
+        pre_g = int(np.gcd.reduce(prefilled[:, [axis, axis + 3]], axis=None)) if len(prefilled) else 0
+        g = _gcd_all([bin_size[axis], item_g, pre_g])
+        factors.append(g or 1)
+    return tuple(factors)
+
+
+def get_packer_class(engine):
+    """按名称取装箱引擎：grid（全格扫描，默认）/ sparse（稀疏矩形）/ extreme_points（极点）。"""
+    if engine == "grid":
+        return SmartPacker
+    if engine == "sparse":
+        from .sparse import SparsePacker
+        return SparsePacker
+    if engine == "extreme_points":
+        from .extreme_points import ExtremePointPacker
+        return ExtremePointPacker
+    raise ValueError(f"未知的装箱引擎: {engine}")
+
+
+def quantize_grid_factors(exact_factors, tolerance_mm):
+    """容差（快速）模式：各轴步长放大为精确步长不超过容差的最大整数倍。
+
+    物品尺寸向上取整、容器尺寸向下取整到新步长，每条边最多多占 tolerance_mm - 1，
+    返回结果在真实毫米下仍然不重叠、不出界。新步长仍是精确步长的倍数，
+    精确步长大于容差一半的轴保持精确。
+    """
+    tolerance_mm = int(tolerance_mm or 0)
+    if tolerance_mm <= 1:
+        return tuple(exact_factors)
+    return tuple(max(f, tolerance_mm // f * f) for f in exact_factors)
 
-                if found:
-                    new_z = bz + rh
-                    self.height_map[bx: bx + rw, by: by + rd] = new_z
 
-                    self.items.append({
-                        "name": name,
-                        "pos": [int(bx), int(bz), int(by)],
-                        "dim": [int(rw), int(rh), int(rd)]
-                    })
-                    placed = True
-                    break
+# 单个请求高度场（高度图 + 金字塔 + 区域最大值表）的内存上限。按实际分配的字节数算：
+# 高度图用最窄的无符号类型，矮容器（uint8）能接受的面积是原来 int32 时的约 4 倍；
+# 表的缓存上限取高度图与金字塔之外剩下的部分（见 index_budget）
+MAX_HEIGHT_FIELD_BYTES = 400 * 1024 * 1024
+# 单次请求的物品总件数上限
+LIMIT_COUNT = 5000
+# 块装模式下的上限：搜索次数与块数有关、与件数无关，只受输出大小限制
+LIMIT_COUNT_BLOCKS = 100_000
+# 单次请求最多使用的容器数
+MAX_BINS = 100
 
-            # 如果一个也放不下，直接结束（保持原行为：无返回/无异常）
 
+def index_budget(field_nbytes, packers=1, cap=MAX_HEIGHT_FIELD_BYTES):
+    """packers 个同尺寸 packer 同时存在时，每个 packer 区域最大值表的缓存上限（字节）。
+
+    各自的高度场（field_nbytes）加上表合计不超过 cap（默认 MAX_HEIGHT_FIELD_BYTES）；
+    上限更小只会让表更常被淘汰（改用金字塔搜索），不影响结果。
+    """
+    return max(0, min(FOOTPRINT_CACHE_BYTES, cap // packers - field_nbytes))
 
-def calculate_smart_factor(dims):
-    """智能去零算法"""
-    valid_dims = [d for d in dims if d > 0]
-    if not valid_dims: return 1
-    factor = 1
-    while all(d % 10 == 0 for d in valid_dims):
-        factor *= 10
-        valid_dims = [d // 10 for d in valid_dims]
-    return factor
 
+def unit_limit(data):
+    """该请求允许的物品总件数上限。"""
+    return LIMIT_COUNT_BLOCKS if getattr(data, "block_mode", None) else LIMIT_COUNT
 
-# 增加一个最大像素限制 (约 400MB 内存占用)
-# 100,000,000 像素点 x 4字节 = 381 MB
-MAX_AREA_LIMIT = 100_000_000
 
+def _quantization_loss(data, placed, steps, exact_factors):
+    """容差模式的代价：实际用到的最大富余（mm）与损失的体积（mm³）。
 
-def run_packing(data):
+    损失体积 = 容器向下取整丢掉的体积 + 每个已装物品网格块比物品本身多出的体积。
     """
-    全加速引擎 + 统计未装箱货物
+    item_dims = [v for it in data.items for v in (it.w, it.h, it.d)]
+    slack = 0
+    for axis, (s, f) in enumerate(zip(steps, exact_factors)):
+        if s == f:
+            continue
+        slack = max(slack, data.bin_size[axis] % s)
+        for v in item_dims:
+            slack = max(slack, -v % s)
+
+    cell = steps[0] * steps[1] * steps[2]
+    bin_w, bin_h, bin_d = data.bin_size
+    lost = bin_w * bin_h * bin_d - (bin_w // steps[0]) * (bin_h // steps[1]) * (bin_d // steps[2]) * cell
+    for it in placed:
+        gw, gh, gd = it["dim"]
+        rw, rh, rd = it["size"]
+        lost += gw * gh * gd * cell - rw * rh * rd
+    return {"tolerance_mm": slack, "lost_volume_mm3": lost}
+
+
+def _raise_first_failure(checks):
+    """checks 为 [(逐行布尔数组, 报错信息), ...]：有不合格的行时，按第一行不合格的物品、
+    同一行内按 checks 的顺序抛出 ValueError（与逐件逐项检查的报错相同）。"""
+    bad = np.zeros(len(checks[0][0]), dtype=bool)
+    for mask, _ in checks:
+        bad |= mask
+    if bad.any():
+        row = int(bad.argmax())
+        raise ValueError(next(message for mask, message in checks if mask[row]))
+
+
+def _check_prefilled(prefilled, bin_size):
+    """整批校验 prefilled（_prefilled_array 的数组）：尺寸为正、坐标非负、不超出容器。"""
+    px, pz, py, pw, ph, pd = prefilled.T
+    _raise_first_failure([
+        ((prefilled[:, 3:] <= 0).any(axis=1), "prefilled 物品尺寸必须为正数"),
+        ((prefilled[:, :3] < 0).any(axis=1), "prefilled 物品坐标不能为负数"),
+        ((px + pw > bin_size[0]) | (py + pd > bin_size[2]) | (pz + ph > bin_size[1]), "prefilled 物品超出容器范围"),
+    ])
+
+
+def _prefilled_rects(data, prefilled, steps, grid):
+    """校验 prefilled（_prefilled_array 的数组）并换算成网格上的占用矩形 (x0, y0, w, d, top)。"""
+    if not len(prefilled):
+        return []
+    _check_prefilled(prefilled, data.bin_size)
+    fx, fy, fz = steps
+    scaled_bin_w, scaled_bin_h, scaled_bin_d = grid
+    # 坐标/尺寸统一按 mm 传入
+    px, pz, py, pw, ph, pd = prefilled.T
+
+    # 按各轴步长缩放：起点向下、终点向上取整（只会多占，不会少占），
+    # 再裁到网格容器内。精确模式下两者都是整除，与原来一致。
+    x0, x1 = px // fx, np.minimum(-(-(px + pw) // fx), scaled_bin_w)
+    y0, y1 = py // fz, np.minimum(-(-(py + pd) // fz), scaled_bin_d)
+    top = np.minimum(-(-(pz + ph) // fy), scaled_bin_h)
+
+    keep = (x0 < x1) & (y0 < y1)
+    rects = np.stack([x0, y0, x1 - x0, y1 - y0, top], axis=1)[keep]
+    return [tuple(r) for r in rects.tolist()]
+
+
+def _mid(x):
+    return sorted([x.w, x.h, x.d])[1]
+
+
+# 排序策略：名称 -> (排序键, 是否降序, 是否优先“躺平”姿态)
+# - auto：总智能装箱，体积大/高度大优先（原策略）
+# - prefill：先填充，更像“铺层”，同等体积下更矮更优先
+# 其余只在组合模式（portfolio）中使用。
+SORT_STRATEGIES = {
+    "auto": (lambda x: (x.w * x.h * x.d, x.h), True, False),
+    "prefill": (lambda x: (min(x.w, x.h, x.d), -(_mid(x) * max(x.w, x.h, x.d)), x.w * x.h * x.d), False, True),
+    "auto_flat": (lambda x: (x.w * x.h * x.d, x.h), True, True),
+    "height_desc": (lambda x: (x.h, x.w * x.h * x.d), True, False),
+    "base_area_desc": (lambda x: (x.w * x.d, x.h), True, False),
+    "longest_edge_desc": (lambda x: (max(x.w, x.h, x.d), x.w * x.h * x.d), True, False),
+    "longest_edge_flat": (lambda x: (max(x.w, x.h, x.d), x.w * x.h * x.d), True, True),
+}
+
+
+def _pack_with_strategy(packer_cls, grid, steps, prefilled_rects, items, strategy, block, should_stop, deadline,
+                        max_bins=1, resume=None, trail=None, on_progress=None, index_budget=FOOTPRINT_CACHE_BYTES):
+    """用一个排序策略跑一遍贪心装箱，返回装好的 packer（每次都是新的 SmartPacker）。
+
+    到达 deadline 后停止放置；被打断的物品组及之后未开始的组记入 packer.deadline_names。
+    max_bins > 1 时，当前容器装不下的部分按同样的顺序装进下一个同规格的空容器
+    （prefilled 只属于第一个容器），直到全部装完或容器用完。
+
+    resume / trail（见 checkpoints.GroupCheckpoints，仅单容器）：从 resume 中与本次相同的
+    前若干组之后继续装；trail 记录本次每组装完后的检查点。packer.resumed_groups 为跳过的组数。
+    on_progress: 见 SmartPacker.on_progress。index_budget: 见 SmartPacker.__init__。
     """
-    start_perf = time.perf_counter()
-
-    # --- 安全检查逻辑 (保持不变) ---
-    raw_area = data.bin_size[0] * data.bin_size[2]
-    MAX_AREA_LIMIT = 100_000_000
-    if raw_area > MAX_AREA_LIMIT:
-        all_dims_temp = [data.bin_size[0], data.bin_size[1], data.bin_size[2]]
-        factor_temp = calculate_smart_factor(all_dims_temp)
-        if (raw_area / (factor_temp * factor_temp)) > MAX_AREA_LIMIT:
-            raise ValueError(f"容器尺寸过大！")
-
-    total_items = sum(item.count for item in data.items)
-    LIMIT_COUNT = 5000
-    if total_items > LIMIT_COUNT:
-        raise ValueError(f"物品总数过多 ({total_items}个)！")
-
-    # --- 计算逻辑 (保持不变) ---
-    all_dims = [data.bin_size[0], data.bin_size[1], data.bin_size[2]]
-    for item in data.items:
-        all_dims.extend([item.w, item.h, item.d])
-
-    factor = calculate_smart_factor(all_dims)
-
-    scaled_bin_w = data.bin_size[0] // factor
-    scaled_bin_h = data.bin_size[1] // factor
-    scaled_bin_d = data.bin_size[2] // factor
-
-    packer = SmartPacker(scaled_bin_w, scaled_bin_h, scaled_bin_d)
-
-    # --- 计算逻辑 (保持不变) ---
-    all_dims = [data.bin_size[0], data.bin_size[1], data.bin_size[2]]
-    for item in data.items:
-        all_dims.extend([item.w, item.h, item.d])
-
-    # prefilled 也参与 factor 计算，保证缩放一致
-    prefilled_for_factor = getattr(data, "prefilled", None) or []
-    for it in prefilled_for_factor:
-        all_dims.extend([it.pos[0], it.pos[1], it.pos[2], it.dim[0], it.dim[1], it.dim[2]])
-
-    factor = calculate_smart_factor(all_dims)
-
-    scaled_bin_w = data.bin_size[0] // factor
-    scaled_bin_h = data.bin_size[1] // factor
-    scaled_bin_d = data.bin_size[2] // factor
-
-    packer = SmartPacker(scaled_bin_w, scaled_bin_h, scaled_bin_d)
-
-    # --- ✅ 新增：先把 prefilled（已固定放置）的物品“压入”高度图 ---
-    prefilled = getattr(data, "prefilled", None) or []
-    if prefilled:
-        for it in prefilled:
-            # 坐标/尺寸统一按 mm 传入，这里按 factor 缩放
-            x = int(it.pos[0] // factor)
-            z = int(it.pos[1] // factor)
-            y = int(it.pos[2] // factor)
-            w = int(it.dim[0] // factor)
-            h = int(it.dim[1] // factor)
-            d = int(it.dim[2] // factor)
-
-            # 基本校验
-            if w <= 0 or h <= 0 or d <= 0:
-                raise ValueError("prefilled 物品尺寸必须为正数")
-            if x < 0 or y < 0 or z < 0:
-                raise ValueError("prefilled 物品坐标不能为负数")
-            if x + w > scaled_bin_w or y + d > scaled_bin_d or z + h > scaled_bin_h:
-                raise ValueError("prefilled 物品超出容器范围")
-
-            new_z = z + h
-            # height_map 表达占用：对区域做 max
-            region = packer.height_map[x: x + w, y: y + d]
-            packer.height_map[x: x + w, y: y + d] = np.maximum(region, new_z)
-
-    # 排序
-    # - 总智能装箱：体积大/高度大优先（原策略）
-    # - 先填充：更像“铺层”，同等体积下更矮更优先
-    phase = (getattr(data, "phase", None) or "auto").lower()
-    if phase == "prefill":
-        sorted_items = sorted(
-            data.items,
-            key=lambda x: (min(x.w, x.h, x.d), -(sorted([x.w, x.h, x.d])[1] * max(x.w, x.h, x.d)), x.w * x.h * x.d),
-        )
-    else:
-        sorted_items = sorted(data.items, key=lambda x: (x.w * x.h * x.d, x.h), reverse=True)
-
-    # 核心装箱循环
-    for item in sorted_items:
-        packer.add_item_group(
-            item.name,
-            item.w // factor,
-            item.h // factor,
-            item.d // factor,
-            item.count,
-            prefer_low_height=(phase == "prefill"),
-        )
-
-    # --- 【新增】统计未装入的货物 ---
-    # 1. 统计实际装了多少 (packer.items 里是平铺的，需要聚合)
+    key, reverse, prefer_low_height = SORT_STRATEGIES[strategy]
+    packer = packer_cls(*grid, scale=steps, index_budget=index_budget)
+    packer.should_stop = should_stop
+    packer.on_progress = on_progress
+    packer.deadline = deadline
+    packer.deadline_names = set()
+    # height_map 表达占用：对区域做 max
+    for x0, y0, w, d, top in prefilled_rects:
+        packer.occupy(x0, y0, w, d, top)
+
+    ordered = sorted(items, key=key, reverse=reverse)
+    packer.resumed_groups = 0
+    if resume is not None or trail is not None:
+        from .checkpoints import group_context, group_key
+
+        context = group_context(packer_cls, grid, steps, strategy, block, prefilled_rects)
+        groups = [group_key(item) for item in ordered]
+        packer.track_changes = True
+        if resume is not None:
+            packer.resumed_groups = resume.restore(packer, context, groups)
+        if trail is not None:
+            trail.start(context, resume, packer.resumed_groups)
+
+    # 核心装箱循环：每组记下剩余件数，留给下一个容器
+    pending = [[item, int(item.count)] for item in ordered]
+    for b in range(max_bins):
+        if b:
+            packer.next_bin()
+        placed_before = len(packer.items)
+        for g, entry in enumerate(pending):
+            item, left = entry
+            if g < packer.resumed_groups:
+                # 检查点里已经装好的组（只用于单容器）：剩余件数不再参与后面的容器
+                entry[1] = 0
+                continue
+            if packer.deadline_hit:
+                if left > 0:
+                    packer.deadline_names.add(item.name)
+                continue
+            if left > 0:
+                n = len(packer.items)
+                packer.add_item_group(
+                    item.name,
+                    item.w,
+                    item.h,
+                    item.d,
+                    left,
+                    prefer_low_height=prefer_low_height,
+                    block=block,
+                )
+                entry[1] -= len(packer.items) - n
+            if packer.deadline_hit:
+                packer.deadline_names.add(item.name)
+            elif trail is not None:
+                trail.record(packer, groups[g])
+        pending = [entry for entry in pending if entry[1] > 0]
+        # 全部装完、时间用完，或空容器一件也装不下（再换空容器也一样）时停止
+        empty_bin = b > 0 or not prefilled_rects
+        if not pending or packer.deadline_hit or (empty_bin and len(packer.items) == placed_before):
+            break
+    return packer
+
+
+def _packed_volume(packer):
+    return sum(a * b * c for a, b, c in (it["size"] for it in packer.items))
+
+
+def _run_portfolio(pack, first, field_nbytes):
+    """组合模式：多个排序策略并行各跑一遍，取装入体积最大的结果（相同时按策略顺序取先者）。
+
+    计算内核释放 GIL，各策略用线程并行即可。同时运行的策略数不超过本线程的内核核数
+    （进程池里即每个进程分到的核数），各策略线程再均分这些核，进程的线程总数不因组合模式增加。
+    同时运行的策略数还受内存限制：每个 packer 常驻高度场加区域最大值表，
+    同时存在的 packer 合计不超过 MAX_HEIGHT_FIELD_BYTES。每个 packer 至少留出与高度场
+    同样大的表预算（否则表建不起来、只能走金字塔），由此决定并行数，再均分剩下的预算。
+    返回 (胜出的 packer, {"winner": 名称, "runs": {名称: 统计}})。
+    """
+    names = [first] + [n for n in SORT_STRATEGIES if n != first]
+    threads = kernel_threads()
+    workers = min(len(names), threads, max(1, MAX_HEIGHT_FIELD_BYTES // max(1, 2 * field_nbytes)))
+    share = max(1, threads // workers)
+    budget = index_budget(field_nbytes, workers)
+
+    def run(name):
+        set_kernel_threads(share)
+        t = time.perf_counter()
+        packer = pack(name, budget=budget)
+        # 只比较装入结果：高度场立即释放，并行上限才对全部策略成立
+        packer.release_height_field()
+        return packer, (time.perf_counter() - t) * 1000
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run, names))
+
+    runs = {}
+    best = None
+    for name, (packer, ms) in zip(names, results):
+        volume = _packed_volume(packer)
+        runs[name] = {"ms": round(ms, 1), "packed": len(packer.items), "packed_volume_mm3": volume}
+        if best is None or volume > best[1]:
+            best = (packer, volume, name)
+    return best[0], {"winner": best[2], "runs": runs}
+
+
+def _unpacked_stats(items, placed, deadline_names=()):
+    """对比请求数量与实际装入件数，返回未装入统计（按请求中的物品顺序）。"""
+    # 1. 统计实际装了多少 (placed 里是平铺的，需要聚合)
     packed_counter = {}
-    for it in packer.items:
+    for it in placed:
         name = it["name"]
         packed_counter[name] = packed_counter.get(name, 0) + 1
 
     # 2. 对比请求数量
     unpacked_list = []
-    for item in data.items:
+    for item in items:
         name = item.name
         requested_count = item.count
         actual_count = packed_counter.get(name, 0)
@@ -266,21 +759,164 @@ def run_packing(data):
             unpacked_list.append({
                 "name": name,
                 "left": left_over,
-                "total": requested_count
+                "total": requested_count,
+                # 未装入原因：deadline = 时间预算用完时还没轮到 / 没放完；no_space = 放不下
+                "reason": "deadline" if name in deadline_names else "no_space",
             })
+    return unpacked_list
+
 
-    # --- 还原坐标 (保持不变) ---
-    final_items = []
-    for it in packer.items:
-        final_items.append({
+def run_packing(data, should_stop=None, resume=None, trail=None, progress=None, deadline_at=None):
+    """
+    全加速引擎 + 统计未装箱货物
+
+    should_stop: 可选的取消检查（无参可调用对象），每件物品前调用一次，
+    返回 True 时抛出 PackingCancelled。
+    data.time_budget_ms: 可选的时间预算，到点后返回已放好的部分，其余记为 reason=deadline。
+    deadline_at: 可选的预算截止时刻（time.time()）。进程池由接收请求的进程按到达时刻算出，
+    排队的时间也计入预算；不给时预算从本函数开始计算起算。
+    resume / trail: 可选的 checkpoints.GroupCheckpoints。从 resume 中相同的前若干组之后续装；
+    trail 记录本次每组的检查点。多容器与组合模式下不使用。
+    progress: 可选的回调，按装入顺序分批收到新装好的物品（与返回的 items 格式相同），
+    全部批次拼起来就是返回的 items。组合模式下要等各策略都算完，最后一次性给出。
+    """
+    start_perf = time.perf_counter()
+
+    engine = (getattr(data, "engine", None) or "grid").lower()
+    packer_cls = get_packer_class(engine)
+
+    # prefilled 可以是物品列表，也可以是已经整理好的 (m, 6) 数组（进程池子进程直接传数组）
+    prefilled = getattr(data, "prefilled", None)
+    prefilled = _prefilled_array(prefilled if prefilled is not None else [])
+
+    total_items = sum(item.count for item in data.items)
+    if total_items > unit_limit(data):
+        raise ValueError(f"物品总数过多 ({total_items}个)！")
+    # 与紧凑请求格式的校验相同（块装模式按尺寸计算每块件数，尺寸为 0 时无意义）
+    if any(min(item.w, item.h, item.d) <= 0 for item in data.items):
+        raise ValueError("物品尺寸必须为正数")
+
+    # --- 网格缩放：各轴取最大公约数，prefilled 也参与，保证缩放一致 ---
+    exact_factors = calculate_grid_factors(data.bin_size, data.items, prefilled)
+    # 容差模式：允许几毫米的富余，换更粗的网格
+    fx, fy, fz = quantize_grid_factors(exact_factors, getattr(data, "tolerance_mm", None))
+    quantized = (fx, fy, fz) != exact_factors
+
+    # 容器向下取整（容差模式下保守；精确模式下本来就整除）
+    scaled_bin_w = data.bin_size[0] // fx
+    scaled_bin_h = data.bin_size[1] // fy
+    scaled_bin_d = data.bin_size[2] // fz
+
+    # --- 安全检查：按缩放后高度场实际要分配的字节数判断 ---
+    # 极点引擎不分配稠密高度图，字节数为 0，不受限制。区域最大值表只用剩下的部分（见 index_budget）
+    field_nbytes = packer_cls.height_field_nbytes(scaled_bin_w, scaled_bin_h, scaled_bin_d)
+    if field_nbytes > MAX_HEIGHT_FIELD_BYTES:
+        raise ValueError(f"容器尺寸过大！")
+
+    # --- ✅ 新增：先把 prefilled（已固定放置）的物品换算成网格上的占用矩形 ---
+    grid = (scaled_bin_w, scaled_bin_h, scaled_bin_d)
+    prefilled_rects = _prefilled_rects(data, prefilled, (fx, fy, fz), grid)
+
+    phase = (getattr(data, "phase", None) or "auto").lower()
+    default_strategy = "prefill" if phase == "prefill" else "auto"
+    block = bool(getattr(data, "block_mode", None))
+    max_bins = int(getattr(data, "max_bins", None) or 1)
+    if max_bins < 1 or max_bins > MAX_BINS:
+        raise ValueError(f"容器数量必须在 1 到 {MAX_BINS} 之间")
+
+    # 时间预算：从开始计算（或给出的 deadline_at 对应的到达时刻）起算，到点后返回已放好的部分
+    # （请求模型要求至少 1 毫秒；直接调用时 0 或负数按不限时处理，而不是一开始就到点）
+    budget_ms = getattr(data, "time_budget_ms", None)
+    if budget_ms is not None and budget_ms <= 0:
+        budget_ms = None
+    deadline = start_perf + budget_ms / 1000 if budget_ms else None
+    if deadline is not None and deadline_at is not None:
+        # 墙上时钟换算成本进程的 perf_counter
+        deadline = time.perf_counter() + (deadline_at - time.time())
+
+    # --- 还原坐标：网格坐标乘回步长 ---
+    def to_final(it):
+        out = {
             "name": it["name"],
-            "pos": [p * factor for p in it["pos"]],
-            "dim": [d * factor for d in it["dim"]]
-        })
+            "pos": [p * f for p, f in zip(it["pos"], (fx, fy, fz))],
+            # 输出真实尺寸（容差模式下网格块会略大于物品本身）
+            "dim": list(it["size"])
+        }
+        if max_bins > 1:
+            # 多容器：所在容器序号（0 起），坐标相对该容器
+            out["bin"] = it["bin"]
+        return out
+
+    emitted = 0
+
+    def flush(packer):
+        nonlocal emitted
+        if len(packer.items) > emitted:
+            progress([to_final(it) for it in packer.items[emitted:]])
+            emitted = len(packer.items)
+
+    def pack(strategy, resume=None, trail=None, on_progress=None, budget=None):
+        # 表的缓存上限：默认只有一个 packer，用尽高度场之外剩下的部分
+        budget = index_budget(field_nbytes) if budget is None else budget
+        return _pack_with_strategy(
+            packer_cls, grid, (fx, fy, fz), prefilled_rects, data.items, strategy, block, should_stop, deadline,
+            max_bins, resume, trail, on_progress, budget,
+        )
+
+    on_progress = flush if progress is not None else None
+    portfolio = None
+    if getattr(data, "portfolio", None):
+        packer, portfolio = _run_portfolio(pack, default_strategy, field_nbytes)
+    elif max_bins == 1:
+        packer = pack(default_strategy, resume, trail, on_progress)
+    else:
+        packer = pack(default_strategy, on_progress=on_progress)
+    if progress is not None:
+        flush(packer)
+
+    # --- 【新增】统计未装入的货物 ---
+    unpacked_list = _unpacked_stats(data.items, packer.items, packer.deadline_names)
+
+    final_items = [to_final(it) for it in packer.items]
+
+    stats = {
+        # 因“同样或更小的姿态已确认放不下”而跳过的搜索次数
+        "skipped_searches": packer.skipped_searches,
+        # 各轴网格步长（mm）与网格尺寸 [x, 高度, y]
+        "grid_factor": [fx, fy, fz],
+        "grid_size": [scaled_bin_w, scaled_bin_h, scaled_bin_d],
+        # 计算内核实现：numba / numpy（无 numba 时的向量化降级）
+        "kernel": ENGINE,
+    }
+    if max_bins > 1:
+        # 实际用到的容器数
+        # （按摆放算：换到下一个容器后可能一件也没装进去，或者刚换就到了时间预算）
+        stats["bins_used"] = max(it["bin"] for it in packer.items) + 1 if packer.items else 0
+    if resume is not None:
+        # 从检查点续装时跳过的物品组数
+        stats["resumed_groups"] = packer.resumed_groups
+    if trail is not None and trail.context is not None:
+        # 本次记录的检查点：组数与占用字节数
+        stats["checkpoint_groups"] = len(trail.groups)
+        stats["checkpoint_bytes"] = trail.nbytes
+    if budget_ms:
+        stats["time_budget_ms"] = budget_ms
+        # 是否因时间预算用完而提前结束
+        stats["deadline_hit"] = packer.deadline_hit
+    if portfolio is not None:
+        # 组合模式：胜出的策略，以及每个策略的耗时 / 装入件数 / 装入体积
+        stats["strategy"] = portfolio["winner"]
+        stats["strategies"] = portfolio["runs"]
+    if getattr(data, "block_mode", None):
+        # 块装模式下实际放置的块数（每块一次高度图更新）
+        stats["blocks_placed"] = packer.blocks_placed
+    if quantized:
+        stats.update(_quantization_loss(data, packer.items, (fx, fy, fz), exact_factors))
 
     duration = time.perf_counter() - start_perf
     print(
-        f"⚡ [Backend] 耗时: {duration:.4f}s | 装入: {len(final_items)} | 未装: {sum(x['left'] for x in unpacked_list)}")
+        f"⚡ [Backend] 耗时: {duration:.4f}s | 装入: {len(final_items)} | 未装: {sum(x['left'] for x in unpacked_list)}"
+        f" | 跳过搜索: {packer.skipped_searches}")
 
-    # 返回两个列表：装好的 items，和没装进去的统计
-    return final_items, unpacked_list
\ No newline at end of file
+    # 返回：装好的 items、没装进去的统计、计算统计
+    return final_items, unpacked_list, stats
\ No newline at end of file
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 class ItemModel(BaseModel):
@@ -24,3 +24,41 @@ class PackingRequestV2(PackingRequest):
     # 计算阶段："prefill" 表示“先填充”，"auto"/None 表示总智能装箱
     # 先填充阶段会启用“尽量躺平/尽量低矮”的旋转偏好
     phase: Optional[str] = None
+    # 装箱引擎："grid"/None 为全格扫描（默认）；"sparse" 把高度场存为矩形集合，
+    # 结果与 grid 相同，但内存和搜索代价只随箱子数增长、不受容器面积限制；
+    # "extreme_points" 只评估候选角点（结果不保证与 grid 相同）。后两者适合大容器少量大件
+    engine: Optional[str] = None
+    # 容差（快速）模式：允许每条边最多多占 tolerance_mm - 1 毫米，换更粗的网格、快得多的结果。
+    # 物品尺寸向上取整、容器向下取整，返回的摆放在真实毫米下仍然合法。None/0/1 为精确模式
+    tolerance_mm: Optional[int] = None
+    # 块装模式：同类物品按 a × b × c 整块放置（一次搜索、一次更新），放不下再拆小。
+    # 件数上限从 5000 提高到 100000，输出仍是逐件摆放，但摆放结果与逐件放置不同
+    block_mode: Optional[bool] = None
+    # 组合模式：多个排序 / 旋转偏好策略并行各算一遍，返回装入体积最大的结果，
+    # stats 中给出胜出策略与各策略耗时
+    portfolio: Optional[bool] = None
+    # 时间预算（毫秒）：到点后停止放置，返回已放好的部分；
+    # 未来得及放的物品在 unpacked 中标记 reason="deadline"，stats.deadline_hit 为 True。至少 1 毫秒
+    time_budget_ms: Optional[int] = Field(None, ge=1)
+    # 最多使用的容器数（同规格）：当前容器装不下的部分依次装进下一个空容器，
+    # 每件摆放带 bin（容器序号，0 起），stats.bins_used 为实际用到的容器数。None/1 为单容器
+    max_bins: Optional[int] = None
+    # 检查点：checkpoint=True 时按物品组记录检查点，stats.checkpoint_id 供之后的请求引用；
+    # resume_from 为之前结果的 checkpoint_id，前面没变的物品组直接沿用，只重算改动之后的部分
+    # （结果与从头计算相同；检查点已过期时从头计算）。单容器、非组合模式下生效
+    checkpoint: Optional[bool] = None
+    resume_from: Optional[str] = None
+
+class PackingBatchRequest(BaseModel):
+    """批量装箱：多个互不相关的请求，按顺序返回各自的结果"""
+    jobs: List[PackingRequestV2]
+
+class PackingSessionCreate(BaseModel):
+    """创建先填充会话：容器与引擎在会话内固定"""
+    bin_size: List[int]
+    engine: Optional[str] = None
+
+class PackingSessionBatch(BaseModel):
+    """向先填充会话追加一批物品（在会话已有的摆放上继续装）"""
+    items: List[ItemModel]
+    phase: Optional[str] = "prefill"
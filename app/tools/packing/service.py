@@ -1,3 +1,113 @@
-from .packer import run_packing
+from app.core.settings import settings
+
+# 本模块只做入口，numpy / numba / 进程池都在第一次用到时才导入：
+# 只处理认证、计费、后台流量的进程不会加载它们。
+
+__all__ = ["get_packing_executor", "get_result_cache", "run_packing_cached",
+           "get_session_store", "get_checkpoint_store", "packing_status"]
+
+_executor = None
+_cache = None
+_sessions = None
+_checkpoints = None
+
+
+def get_packing_executor():
+    """全局装箱进程池（首次调用时创建，start 时才真正拉起进程）。"""
+    global _executor
+    if _executor is None:
+        from .executor import PackingExecutor
+
+        _executor = PackingExecutor(settings.PACKING_WORKERS, settings.PACKING_NUM_THREADS)
+    return _executor
+
+
+def get_result_cache():
+    """全局装箱结果缓存（首次调用时创建）。"""
+    global _cache
+    if _cache is None:
+        from .cache import ResultCache
+        from .packer import PackingCancelled, PackingUnavailable
+
+        # 先到的请求被取消或碰上进程池重建时，等待者自己重新计算
+        _cache = ResultCache(
+            settings.PACKING_CACHE_MAX_BYTES, settings.PACKING_CACHE_TTL_S,
+            retry_on=(PackingCancelled, PackingUnavailable),
+        )
+    return _cache
+
+
+def get_checkpoint_store():
+    """全局物品组检查点表（首次调用时创建）。"""
+    global _checkpoints
+    if _checkpoints is None:
+        from .checkpoints import CheckpointStore
+
+        _checkpoints = CheckpointStore(settings.PACKING_CHECKPOINT_STORE_BYTES, settings.PACKING_CHECKPOINT_TTL_S)
+    return _checkpoints
+
+
+async def _run_checkpointed(data, is_disconnected=None):
+    """按 resume_from 从检查点续装，checkpoint=True 时保存本次的检查点并在 stats 中返回其 id。"""
+    store = get_checkpoint_store()
+    resume = store.get(data.resume_from) if getattr(data, "resume_from", None) else None
+    trail_bytes = settings.PACKING_CHECKPOINT_MAX_BYTES if getattr(data, "checkpoint", None) else 0
+    items, unpacked, stats, trail = await get_packing_executor().run_checkpointed(
+        data, is_disconnected=is_disconnected, resume=resume, trail_bytes=trail_bytes
+    )
+    if stats.get("resumed_groups"):
+        store.resumed += 1
+    if trail is not None:
+        # 时间预算用完时只记录了之前完整装完的组，前缀仍然可用
+        stats["checkpoint_id"] = store.put(trail)
+    return items, unpacked, stats
+
+
+async def run_packing_cached(data, is_disconnected=None):
+    """经结果缓存在进程池里计算，返回 ((items, unpacked, stats), 缓存状态)。
+
+    缓存状态为 "hit" / "coalesced" / "miss"；缓存关闭时为 "bypass"。
+    带检查点的请求（checkpoint / resume_from）不经缓存：stats 中的 checkpoint_id 每次不同。
+    """
+    if getattr(data, "checkpoint", None) or getattr(data, "resume_from", None):
+        return await _run_checkpointed(data, is_disconnected), "bypass"
+
+    executor = get_packing_executor()
+    cache = get_result_cache()
+    if not cache.enabled:
+        return await executor.run(data, is_disconnected=is_disconnected), "bypass"
+
+    from .cache import request_key
+
+    return await cache.get_or_compute(
+        request_key(data), lambda: executor.run(data, is_disconnected=is_disconnected)
+    )
+
+
+def get_session_store():
+    """全局先填充会话表（首次调用时创建）。会话与其高度场常驻本进程。"""
+    global _sessions
+    if _sessions is None:
+        from .session import SessionStore
+
+        # 会话的内核核数与进程池的每个工作进程相同（PACKING_NUM_THREADS 为 0 时按进程数均分）
+        _sessions = SessionStore(
+            settings.PACKING_SESSION_MAX_BYTES, settings.PACKING_SESSION_TTL_S, get_packing_executor().threads,
+            settings.PACKING_SESSION_MAX_BATCH_UNITS, settings.PACKING_SESSION_MAX_PER_OWNER,
+        )
+    return _sessions
+
+
+def packing_status():
+    """进程池与结果缓存状态；本进程还没用到装箱时不为此导入任何重依赖。"""
+    if _executor is None:
+        return {"loaded": False, "ready": False}
+    status = {"loaded": True, **_executor.stats()}
+    if _cache is not None:
+        status["cache"] = _cache.stats()
+    if _sessions is not None:
+        status["sessions"] = _sessions.stats()
+    if _checkpoints is not None:
+        status["checkpoints"] = _checkpoints.stats()
+    return status
 
-__all__ = ["run_packing"]
@@ -0,0 +1,237 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from math import gcd
+
+from .kernels import ENGINE, set_kernel_threads
+from .packer import (
+    LIMIT_COUNT,
+    MAX_HEIGHT_FIELD_BYTES,
+    SORT_STRATEGIES,
+    _unpacked_stats,
+    calculate_grid_factors,
+    get_packer_class,
+    index_budget,
+)
+
+
+# 每件已放置物品（mm 坐标与尺寸）常驻内存的估算字节数
+_PLACEMENT_NBYTES = 400
+
+
+class PackingSession:
+    """服务端常驻的先填充会话：高度场留在内存里，每批物品只在已有占位上增量装入。
+
+    每批的结果与“把之前各批的摆放全部作为 prefilled 再调一次 run_packing”逐件相同：
+    - 网格步长取容器与历次批次物品尺寸的最大公约数。新批次让步长变细时，
+      用已放置物品在新网格上重建高度场（更细的网格不改变最低点搜索的结果）；
+    - 高度图只升不降，失败记录跨批次仍然有效，不用清空。
+    pop 撤销最后一批：清空高度场（复用已分配的缓冲区）后重新占上其余批次的摆放。
+
+    同一会话的操作由 lock 串行化；计算本身在 API 进程的线程里跑。内核释放 GIL，
+    但逐件放置的 Python 循环要持有 GIL，批次越大，同进程其他请求（健康检查、登录……）
+    等得越久。所以单批件数限制为 max_batch_units（远小于 run_packing 的上限）；
+    更大的批次应走进程池：/calculate 带上 prefilled。
+
+    常驻内存（高度场、区域最大值表与已放置物品）不超过 max_bytes（会话表的总上限）：
+    高度场与已放置物品就放不下的批次直接报错，表的缓存上限取剩下的部分。
+    """
+
+    def __init__(self, owner, bin_size, engine=None, max_batch_units=LIMIT_COUNT, max_bytes=MAX_HEIGHT_FIELD_BYTES):
+        bin_size = [int(v) for v in bin_size]
+        if len(bin_size) != 3 or min(bin_size) <= 0:
+            raise ValueError("容器尺寸必须是 3 个正数")
+        self.owner = owner
+        self.bin_size = bin_size
+        self.engine = (engine or "grid").lower()
+        self.packer_cls = get_packer_class(self.engine)
+        self.max_batch_units = min(int(max_batch_units), LIMIT_COUNT)
+        self.max_bytes = min(int(max_bytes), MAX_HEIGHT_FIELD_BYTES)
+        # 每批已放置的物品（mm）：[{"name", "pos", "dim"}, ...]
+        self.batches = []
+        self.factors = None
+        self.packer = None
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+    @property
+    def placed(self):
+        return sum(len(batch) for batch in self.batches)
+
+    @property
+    def nbytes(self):
+        """会话常驻内存：高度场（含缓存的表）加已放置物品。"""
+        field = self.packer.resident_nbytes() if self.packer is not None else 0
+        return field + self.placed * _PLACEMENT_NBYTES
+
+    def _grid(self, factors):
+        return tuple(v // f for v, f in zip(self.bin_size, factors))
+
+    def _rebuild(self, factors):
+        """按 factors 网格把高度场重建为各批摆放的占位；网格不变时复用原缓冲区。"""
+        fx, fy, fz = factors
+        if self.packer is not None and factors == self.factors:
+            self.packer.failed_shapes = []
+            self.packer._reset_height_field()
+        else:
+            # 表的缓存上限在每批开始前按剩余内存设定（见 add_batch）
+            self.packer = self.packer_cls(*self._grid(factors), scale=factors, index_budget=0)
+        self.factors = factors
+        # 各摆放都落在网格上（步长整除所有尺寸与坐标），直接整除换算
+        for batch in self.batches:
+            for it in batch:
+                px, pz, py = it["pos"]
+                pw, ph, pd = it["dim"]
+                self.packer.occupy(px // fx, py // fz, pw // fx, pd // fz, (pz + ph) // fy)
+
+    def add_batch(self, items, phase=None):
+        """装入一批物品，返回 (本批 items, unpacked, stats)，格式与 run_packing 相同。"""
+        start_perf = time.perf_counter()
+        total_items = sum(item.count for item in items)
+        if total_items > self.max_batch_units:
+            raise ValueError(
+                f"会话单批物品过多 ({total_items}个，最多 {self.max_batch_units} 个)！"
+                "更大的批次请用 /calculate 并带上 prefilled"
+            )
+        if any(min(item.w, item.h, item.d) <= 0 for item in items):
+            raise ValueError("物品尺寸必须为正数")
+
+        factors = calculate_grid_factors(self.bin_size, items)
+        if self.factors is not None:
+            factors = tuple(gcd(a, b) for a, b in zip(self.factors, factors))
+        # 高度场与（含本批的）已放置物品先占内存，放不下就报错，而不是算完后被会话表淘汰
+        field_nbytes = self.packer_cls.height_field_nbytes(*self._grid(factors))
+        fixed_nbytes = field_nbytes + (self.placed + total_items) * _PLACEMENT_NBYTES
+        if fixed_nbytes > self.max_bytes:
+            raise ValueError(f"容器尺寸过大，超出会话内存上限（{self.max_bytes // (1024 * 1024)} MB）！")
+        if factors != self.factors:
+            self._rebuild(factors)
+        # 区域最大值表只用剩下的部分：本批结束后整个会话仍不超过 max_bytes
+        self.packer.set_index_budget(index_budget(fixed_nbytes, cap=self.max_bytes))
+
+        strategy = "prefill" if (phase or "").lower() == "prefill" else "auto"
+        key, reverse, prefer_low_height = SORT_STRATEGIES[strategy]
+        packer = self.packer
+        packer.items = []
+        skipped_before = packer.skipped_searches
+        for item in sorted(items, key=key, reverse=reverse):
+            packer.add_item_group(
+                item.name, item.w, item.h, item.d, item.count, prefer_low_height=prefer_low_height
+            )
+
+        placed = [
+            {"name": it["name"], "pos": [p * f for p, f in zip(it["pos"], factors)], "dim": list(it["size"])}
+            for it in packer.items
+        ]
+        unpacked = _unpacked_stats(items, packer.items)
+        packer.items = []
+        self.batches.append(placed)
+
+        stats = {
+            "skipped_searches": packer.skipped_searches - skipped_before,
+            "grid_factor": list(factors),
+            "grid_size": [packer.bin_w, packer.bin_h, packer.bin_d],
+            "kernel": ENGINE,
+            # 本批序号（0 起）与会话内的总摆放数
+            "batch": len(self.batches) - 1,
+            "session_placed": self.placed,
+            "ms": round((time.perf_counter() - start_perf) * 1000, 1),
+        }
+        return placed, unpacked, stats
+
+    def pop(self):
+        """撤销最后一批，返回该批的摆放。"""
+        if not self.batches:
+            raise ValueError("没有可撤销的批次")
+        removed = self.batches.pop()
+        self._rebuild(self.factors)
+        return removed
+
+    def summary(self):
+        return {
+            "bin_size": self.bin_size,
+            "engine": self.engine,
+            "batches": [len(batch) for batch in self.batches],
+            "placed": self.placed,
+            "nbytes": self.nbytes,
+        }
+
+
+class SessionStore:
+    """先填充会话表（本进程内）。
+
+    空闲超过 ttl_s 的会话过期；所有会话的常驻内存合计超过 max_bytes 时，
+    按最近使用顺序淘汰最久未用的会话。单个会话自身不会超过 max_bytes（见 PackingSession），
+    刚操作的会话不会因为自己太大而被淘汰。每个 owner 最多同时保留 max_per_owner 个会话。
+    """
+
+    def __init__(self, max_bytes, ttl_s, threads=0, max_batch_units=LIMIT_COUNT, max_per_owner=8):
+        self.max_bytes = int(max_bytes)
+        self.ttl_s = float(ttl_s)
+        self.threads = int(threads)
+        self.max_batch_units = int(max_batch_units)
+        self.max_per_owner = int(max_per_owner)
+        self._sessions = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def _enforce(self):
+        now = time.monotonic()
+        for sid in [sid for sid, s in self._sessions.items() if now - s.last_used > self.ttl_s]:
+            del self._sessions[sid]
+            self.expirations += 1
+        total = sum(s.nbytes for s in self._sessions.values())
+        while self._sessions and total > self.max_bytes:
+            _, session = self._sessions.popitem(last=False)
+            total -= session.nbytes
+            self.evictions += 1
+
+    def create(self, owner, bin_size, engine=None):
+        self._enforce()
+        if sum(1 for s in self._sessions.values() if s.owner == owner) >= self.max_per_owner:
+            raise ValueError(f"会话数量已达上限（{self.max_per_owner} 个），请先删除不用的会话")
+        session = PackingSession(owner, bin_size, engine, self.max_batch_units, self.max_bytes)
+        sid = uuid.uuid4().hex
+        self._sessions[sid] = session
+        self._enforce()
+        return sid, session
+
+    def get(self, owner, sid):
+        """取会话并标记为最近使用；不存在、已过期或不属于 owner 时返回 None。"""
+        self._enforce()
+        session = self._sessions.get(sid)
+        if session is None or session.owner != owner:
+            return None
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(sid)
+        return session
+
+    def remove(self, owner, sid):
+        session = self.get(owner, sid)
+        if session is not None:
+            del self._sessions[sid]
+        return session is not None
+
+    async def run(self, session, fn, *args):
+        """在线程里串行执行会话操作（add_batch / pop），完成后按内存上限淘汰。"""
+        def call():
+            # 核数按调用线程生效
+            set_kernel_threads(self.threads)
+            return fn(*args)
+
+        async with session.lock:
+            try:
+                return await asyncio.to_thread(call)
+            finally:
+                session.last_used = time.monotonic()
+                self._enforce()
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "bytes": sum(s.nbytes for s in self._sessions.values()),
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
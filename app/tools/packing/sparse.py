@@ -0,0 +1,63 @@
+import numpy as np
+
+from .kernels import sparse_search
+from .packer import SmartPacker
+
+
+class SparsePacker(SmartPacker):
+    """稀疏高度场引擎：高度场存为一组矩形 (x0, x1, y0, y1, top)，不分配稠密高度图。
+
+    搜索只评估 x ∈ {0, 各矩形右边}、y ∈ {0, 各矩形后边} 的候选位置（见 kernels.sparse_search），
+    结果与全格扫描完全相同；内存与单次搜索代价只随矩形数增长，与容器面积无关，
+    适合容器很大、箱子较少（几百个）的情况。
+
+    新放置的箱子顶面一定高于它压住的所有矩形，被它底面完全覆盖的旧矩形不再影响高度场，
+    直接删除，矩形数接近高度场中可见区域的个数。
+    """
+
+    @classmethod
+    def height_field_nbytes(cls, bin_w, bin_h, bin_d):
+        # 不分配稠密高度图，内存只随矩形数增长
+        return 0
+
+    def _init_height_field(self):
+        self._boxes = np.empty((64, 5), dtype=np.int64)
+        self._n_boxes = 0
+
+    def _reset_height_field(self):
+        self._n_boxes = 0
+
+    def resident_nbytes(self):
+        return self._boxes.nbytes
+
+    def find_position(self, rw, rh, rd):
+        rw, rh, rd = int(rw), int(rh), int(rd)
+        if rw > self.bin_w or rd > self.bin_d or rh > self.bin_h:
+            return -1, -1, -1, False
+        boxes = self._boxes[: self._n_boxes]
+        xs = np.unique(np.concatenate(([0], boxes[:, 1])))
+        ys = np.unique(np.concatenate(([0], boxes[:, 3])))
+        xs = xs[xs + rw <= self.bin_w]
+        ys = ys[ys + rd <= self.bin_d]
+        return sparse_search(self._boxes, self._n_boxes, xs, ys, rw, rd, self.bin_h - rh)
+
+    def find_first_position(self, rotations, skip=(), units=1):
+        return self._first_fit_sequential(rotations, skip)
+
+    def occupy(self, x, y, w, d, top):
+        if w <= 0 or d <= 0:
+            return
+        boxes = self._boxes[: self._n_boxes]
+        covered = (
+            (boxes[:, 0] >= x) & (boxes[:, 1] <= x + w)
+            & (boxes[:, 2] >= y) & (boxes[:, 3] <= y + d)
+            & (boxes[:, 4] <= top)
+        )
+        if covered.any():
+            keep = boxes[~covered]
+            self._n_boxes = len(keep)
+            self._boxes[: self._n_boxes] = keep
+        if self._n_boxes == len(self._boxes):
+            self._boxes = np.concatenate([self._boxes, np.empty_like(self._boxes)])
+        self._boxes[self._n_boxes] = (x, x + w, y, y + d, top)
+        self._n_boxes += 1
@@ -0,0 +1,46 @@
+import time
+
+from . import kernels
+from .packer import find_best_pos_numba
+
+
+# 各入口内核的显式签名（与 SmartPacker 实际传入的类型一致：高度图为 uint8 / uint16 / uint32
+# 之一（见 heightmap.height_dtype），标量一律 int64）。每种高度类型各编译一份。
+# 内核都以 cache=True 编译，重启后命中磁盘缓存只需加载，不再编译。
+# 内部调用的小内核随入口内核一起编译，不单独列出。
+_IDX = "int64[::1]"
+
+
+def _signatures(h):
+    hm = f"{h}[:, ::1]"
+    row = f"{h}[::1]"
+    return [
+        (kernels.build_footprint_tables,
+         f"({hm}, int64, int64, {_IDX}, {_IDX}, {_IDX}, {_IDX}, {row}, int64)"),
+        (kernels.row_minima, f"({hm}, {row}, {_IDX}, int64)"),
+        (kernels.raise_window, f"({hm}, {row}, {_IDX}, int64, int64, int64, int64, int64)"),
+        (kernels.first_fit_rotations, f"({row}, {_IDX}, {_IDX}, {_IDX}, {_IDX})"),
+        (kernels.pool_max, f"({hm}, int64, int64, {hm})"),
+        (kernels.raise_tiles, f"({hm}, int64, int64, int64, int64, int64)"),
+        (kernels.pyramid_search, f"({hm}, {hm}, int64, int64, int64, int64, int64, int64, int64)"),
+        (find_best_pos_numba, f"({hm}, int64, int64, int64, int64, int64, int64, int64)"),
+    ]
+
+
+KERNEL_SIGNATURES = [sig for h in ("uint8", "uint16", "uint32") for sig in _signatures(h)] + [
+    # 稀疏引擎不用高度图，矩形与候选坐标都是 int64
+    (kernels.sparse_search, f"(int64[:, ::1], int64, {_IDX}, {_IDX}, int64, int64, int64)"),
+]
+
+
+def warmup():
+    """按 KERNEL_SIGNATURES 预先编译（或从缓存加载）全部内核，返回耗时（秒）。
+
+    没有 numba 时内核是普通 Python 函数，直接返回。
+    """
+    start = time.perf_counter()
+    for fn, sig in KERNEL_SIGNATURES:
+        compile_sig = getattr(fn, "compile", None)
+        if compile_sig is not None:
+            compile_sig(sig)
+    return time.perf_counter() - start
@@ -0,0 +1,2 @@
+# 根目录的 conftest.py：pytest 会把它所在的目录（仓库根目录）加入 sys.path，
+# 这样直接运行 `pytest` 也能导入 app 包，不必写成 `python -m pytest`。
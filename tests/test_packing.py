@@ -0,0 +1,670 @@
+"""装箱引擎的回归测试。
+
+精确模式（索引 / 金字塔搜索、一次评估全部旋转、失败记录、GCD 网格、稀疏引擎、
+会话、检查点）与逐格扫描的基准结果逐件比较；非精确模式（容差、块装、极点引擎、
+多容器、组合）只校验摆放合法：不出界、不重叠、尺寸是物品的某个旋转。
+"""
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.tools.packing import kernels_numpy
+from app.tools.packing.checkpoints import GroupCheckpoints
+from app.tools.packing.packer import (
+    MAX_HEIGHT_FIELD_BYTES,
+    SmartPacker,
+    _pack_with_strategy,
+    _run_portfolio,
+    _prefilled_array,
+    _prefilled_rects,
+    find_best_pos_numba,
+    index_budget,
+    quantize_grid_factors,
+    run_packing,
+)
+from app.tools.packing.schemas import PackingRequestV2
+from app.tools.packing.session import PackingSession
+
+
+class _ReferencePacker(SmartPacker):
+    """语义基准：每个姿态依次逐格扫描（_find_best_in_rows），不用索引、金字塔与失败记录。"""
+
+    def find_first_position(self, rotations, skip=(), units=0):
+        for k, (rw, rh, rd) in enumerate(rotations):
+            bx, bz, by, found = find_best_pos_numba(self.height_map, self.bin_w, self.bin_h, self.bin_d, rw, rh, rd, 1)
+            if found:
+                return k, bx, bz, by, True
+        return -1, -1, -1, -1, False
+
+    def known_to_fail(self, rw, rh, rd):
+        return False
+
+    def record_failure(self, rw, rh, rd):
+        pass
+
+
+def _random_request(rng, prefilled=True, **extra):
+    """步长为 5mm 的小容器：GCD 网格与 1mm 网格都能很快算完。"""
+    bin_size = [5 * rng.randint(8, 16) for _ in range(3)]
+    items = [
+        {"name": f"k{i}", "w": 5 * rng.randint(1, 6), "h": 5 * rng.randint(1, 6), "d": 5 * rng.randint(1, 6),
+         "count": rng.randint(1, 12)}
+        for i in range(rng.randint(1, 4))
+    ]
+    pre = []
+    if prefilled and rng.random() < 0.5:
+        pre.append({"name": "p", "pos": [0, 0, 0], "dim": [bin_size[0] // 2, 5 * rng.randint(1, 4), bin_size[2] // 3]})
+    return PackingRequestV2(
+        bin_size=bin_size, items=items, prefilled=pre, phase=rng.choice([None, "prefill"]), **extra
+    )
+
+
+def _reference_items(data):
+    """1mm 网格上用基准搜索装箱，返回 (name, pos, size) 列表。"""
+    bin_size = tuple(data.bin_size)
+    rects = _prefilled_rects(data, _prefilled_array(data.prefilled), (1, 1, 1), bin_size)
+    strategy = "prefill" if data.phase == "prefill" else "auto"
+    packer = _pack_with_strategy(_ReferencePacker, bin_size, (1, 1, 1), rects, data.items, strategy, False, None, None)
+    return [(it["name"], it["pos"], it["size"]) for it in packer.items]
+
+
+def _items(result):
+    return [(it["name"], it["pos"], it["dim"]) for it in result[0]]
+
+
+def _found(res):
+    """(x, z, y, found)：没找到时其余三项无意义，只比较 found。"""
+    x, z, y, found = res
+    return (int(x), int(z), int(y), True) if found else (False,)
+
+
+def _random_packer(rng, bin_w, bin_h, bin_d, n_boxes):
+    packer = SmartPacker(bin_w, bin_h, bin_d)
+    for _ in range(n_boxes):
+        w, d = rng.randint(1, bin_w // 3), rng.randint(1, bin_d // 3)
+        x, y = rng.randint(0, bin_w - w), rng.randint(0, bin_d - d)
+        top = int(packer.height_map[x: x + w, y: y + d].max()) + rng.randint(1, bin_h // 6)
+        packer.occupy(x, y, w, d, min(top, bin_h))
+    return packer
+
+
+def test_find_position_matches_reference_scan():
+    rng = random.Random(1)
+    for _ in range(30):
+        bin_w, bin_h, bin_d = rng.randint(20, 90), rng.randint(10, 300), rng.randint(20, 90)
+        packer = _random_packer(rng, bin_w, bin_h, bin_d, rng.randint(0, 40))
+        for _ in range(10):
+            rw, rh, rd = rng.randint(1, bin_w), rng.randint(1, bin_h), rng.randint(1, bin_d)
+            expected = find_best_pos_numba(packer.height_map, bin_w, bin_h, bin_d, rw, rh, rd, 1)
+            assert _found(packer.find_position(rw, rh, rd)) == _found(expected)
+
+
+def test_pyramid_search_matches_reference_scan():
+    # 不建表时（表超出缓存上限、或本组件数太少）由粗到细搜索
+    rng = random.Random(8)
+    for _ in range(30):
+        bin_w, bin_h, bin_d = rng.randint(20, 90), rng.randint(10, 300), rng.randint(20, 90)
+        packer = _random_packer(rng, bin_w, bin_h, bin_d, rng.randint(0, 40))
+        for _ in range(10):
+            rw, rh, rd = rng.randint(1, bin_w), rng.randint(1, bin_h), rng.randint(1, bin_d)
+            expected = find_best_pos_numba(packer.height_map, bin_w, bin_h, bin_d, rw, rh, rd, 1)
+            assert _found(packer._find_without_index(rw, rh, rd)) == _found(expected)
+
+
+def test_numpy_fallback_matches_reference_scan():
+    # 无 numba 时的向量化降级
+    rng = random.Random(9)
+    for _ in range(30):
+        bin_w, bin_h, bin_d = rng.randint(20, 90), rng.randint(10, 300), rng.randint(20, 90)
+        packer = _random_packer(rng, bin_w, bin_h, bin_d, rng.randint(0, 40))
+        for _ in range(10):
+            rw, rh, rd = rng.randint(1, bin_w), rng.randint(1, bin_h), rng.randint(1, bin_d)
+            expected = find_best_pos_numba(packer.height_map, bin_w, bin_h, bin_d, rw, rh, rd, 1)
+            fallback = kernels_numpy.find_best_pos(packer.height_map, bin_w, bin_h, bin_d, rw, rh, rd)
+            assert _found(fallback) == _found(expected)
+
+
+def test_find_first_position_matches_sequential_search():
+    rng = random.Random(2)
+    for _ in range(30):
+        packer = _random_packer(rng, 60, 120, 50, rng.randint(0, 40))
+        w, h, d = rng.randint(1, 30), rng.randint(1, 60), rng.randint(1, 30)
+        rotations = list(packer.grid_rotations(w, h, d))
+        k, *expected = _ReferencePacker.find_first_position(packer, rotations)
+        got, *res = packer.find_first_position(rotations, units=100)
+        assert _found(res) == _found(expected) and (got == k or not expected[3])
+
+
+def test_run_packing_matches_reference_on_1mm_grid():
+    rng = random.Random(3)
+    for _ in range(40):
+        data = _random_request(rng)
+        assert _items(run_packing(data)) == _reference_items(data)
+
+
+def test_sparse_engine_matches_grid():
+    rng = random.Random(4)
+    for _ in range(30):
+        data = _random_request(rng)
+        sparse = data.model_copy(update={"engine": "sparse"})
+        assert run_packing(sparse)[:2] == run_packing(data)[:2]
+
+
+def test_session_batches_match_stateless_prefill():
+    rng = random.Random(5)
+    for _ in range(10):
+        bin_size = [5 * rng.randint(10, 16) for _ in range(3)]
+        session = PackingSession(owner=1, bin_size=bin_size)
+        placed = []
+        for _ in range(3):
+            items = _random_request(rng, prefilled=False).items
+            batch, unpacked, _ = session.add_batch(items, "prefill")
+            expected = run_packing(PackingRequestV2(bin_size=bin_size, items=items, prefilled=placed, phase="prefill"))
+            assert (batch, unpacked) == tuple(expected[:2])
+            placed += batch
+
+
+def test_resume_from_checkpoint_matches_full_run():
+    rng = random.Random(6)
+    for _ in range(10):
+        data = _random_request(rng)
+        trail = GroupCheckpoints(64 << 20)
+        run_packing(data, trail=trail)
+        changed = data.model_copy(update={"items": data.items[:-1] + [data.items[-1].model_copy(update={"count": 1})]})
+        assert run_packing(changed, resume=trail)[:2] == run_packing(changed)[:2]
+
+
+def _assert_valid_layout(data, result):
+    """摆放合法：每件在容器内、互不重叠（也不与 prefilled 重叠）、尺寸是物品的某个旋转、件数不超。"""
+    items, unpacked, _ = result
+    dims = {it.name: sorted((it.w, it.h, it.d)) for it in data.items}
+    requested = {it.name: it.count for it in data.items}
+    boxes = {}
+    for it in items:
+        assert sorted(it["dim"]) == dims[it["name"]]
+        requested[it["name"]] -= 1
+        lo = np.array(it["pos"])
+        hi = lo + np.array(it["dim"])
+        # pos / dim 为 [x, 高度, y]，bin_size 为 [宽, 高, 深]
+        assert (lo >= 0).all() and (hi <= np.array(data.bin_size)).all()
+        boxes.setdefault(it.get("bin", 0), []).append((lo, hi))
+    assert all(left >= 0 for left in requested.values())
+    for pre in data.prefilled:
+        lo = np.array(pre.pos)
+        boxes.setdefault(0, []).append((lo, lo + np.array(pre.dim)))
+    for placed in boxes.values():
+        lo = np.array([b[0] for b in placed])
+        hi = np.array([b[1] for b in placed])
+        overlap = ((lo[:, None, :] < hi[None, :, :]) & (lo[None, :, :] < hi[:, None, :])).all(axis=2)
+        np.fill_diagonal(overlap, False)
+        assert not overlap.any()
+
+
+@pytest.mark.parametrize("options", [
+    {"tolerance_mm": 7},
+    {"block_mode": True},
+    {"engine": "extreme_points"},
+    {"max_bins": 3},
+    {"portfolio": True},
+])
+def test_non_exact_modes_produce_valid_layouts(options):
+    rng = random.Random(7)
+    for _ in range(15):
+        data = _random_request(rng, **options)
+        # 非 5 的倍数的尺寸，让容差模式确实向上取整
+        data.items[0].w += rng.randint(0, 4)
+        _assert_valid_layout(data, run_packing(data))
+
+
+def test_quantized_steps_stay_multiples_of_exact_steps():
+    # 10mm 的轴不能变成 15mm（每件多占一半）；1mm 的轴放大到容差
+    assert quantize_grid_factors((10, 1, 25), 15) == (10, 15, 25)
+    assert quantize_grid_factors((4, 6, 20), 15) == (12, 12, 20)
+    assert quantize_grid_factors((4, 6, 20), 1) == (4, 6, 20)
+
+
+def test_process_exits_after_packing_in_a_thread():
+    # 第一次在非主线程里调用并行内核（会话、组合模式都是这样）后，进程必须能正常退出
+    code = (
+        "import threading\n"
+        "from app.tools.packing.packer import run_packing\n"
+        "from app.tools.packing.schemas import PackingRequestV2\n"
+        "req = PackingRequestV2(bin_size=[1201, 1000, 1199], items=[dict(name='a', w=101, h=100, d=103, count=30)])\n"
+        "t = threading.Thread(target=run_packing, args=(req,))\n"
+        "t.start()\n"
+        "t.join()\n"
+    )
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr
+
+
+def test_executor_recovers_after_worker_dies():
+    from app.tools.packing.executor import PackingExecutor
+    from app.tools.packing.packer import PackingUnavailable
+
+    data = PackingRequestV2(bin_size=[100, 100, 100], items=[{"name": "a", "w": 10, "h": 10, "d": 10, "count": 5}])
+
+    async def main():
+        executor = PackingExecutor(1, 1)
+        try:
+            expected = await executor.run(data)
+            # 模拟 OOM killer：杀掉一个工作进程，进程池随之损坏
+            for process in list(executor._pool._processes.values()):
+                process.kill()
+                process.join()
+            with pytest.raises(PackingUnavailable):
+                await executor.run(data)
+            assert executor.restarts == 1 and not executor.ready
+            assert (await executor.run(data))[:2] == expected[:2]
+        finally:
+            executor.shutdown()
+
+    asyncio.run(main())
+
+
+def test_footprint_tables_stay_within_index_budget():
+    # 表的缓存上限只影响速度，不影响结果；常驻内存不超过高度场加上限
+    data = PackingRequestV2(bin_size=[600, 200, 500], items=[
+        {"name": f"k{i}", "w": 10 + 7 * i, "h": 15 + 3 * i, "d": 40 - 3 * i, "count": 60} for i in range(6)
+    ])
+    grid = tuple(data.bin_size)
+    full = _pack_with_strategy(SmartPacker, grid, (1, 1, 1), [], data.items, "auto", False, None, None)
+    field_nbytes = SmartPacker.height_field_nbytes(*grid)
+    budget = 400_000
+    small = _pack_with_strategy(
+        SmartPacker, grid, (1, 1, 1), [], data.items, "auto", False, None, None, index_budget=budget
+    )
+    assert small.items == full.items
+    assert small.index.nbytes <= budget < full.index.nbytes
+    assert small.resident_nbytes() <= field_nbytes + budget
+    # 多个 packer 并存时，高度场与表合计不超过上限
+    assert 4 * (field_nbytes + index_budget(field_nbytes, packers=4)) <= MAX_HEIGHT_FIELD_BYTES
+
+
+@pytest.mark.parametrize("block_mode", [False, True])
+def test_non_positive_item_dimensions_are_rejected(block_mode):
+    data = PackingRequestV2(
+        bin_size=[100, 100, 100], items=[{"name": "a", "w": 0, "h": 10, "d": 10, "count": 5}], block_mode=block_mode
+    )
+    with pytest.raises(ValueError, match="物品尺寸必须为正数"):
+        run_packing(data)
+
+
+def test_portfolio_concurrency_fits_memory_cap():
+    field_nbytes = 72 * 1024 * 1024
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0, "budgets": set()}
+
+    def pack(name, budget):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+            state["budgets"].add(budget)
+        time.sleep(0.05)
+        with lock:
+            state["running"] -= 1
+        return SmartPacker(4, 4, 4)
+
+    _run_portfolio(pack, "auto", field_nbytes)
+    (budget,) = state["budgets"]
+    # 同时存在的 packer（高度场 + 表预算）合计不超过上限，且每个都留有建表的余地
+    assert state["peak"] * (field_nbytes + budget) <= MAX_HEIGHT_FIELD_BYTES
+    assert budget >= field_nbytes
+
+
+def test_non_positive_time_budget():
+    items = [{"name": "a", "w": 10, "h": 10, "d": 10, "count": 5}]
+    with pytest.raises(ValueError):
+        PackingRequestV2(bin_size=[100, 100, 100], items=items, time_budget_ms=-1)
+    # 绕过模型校验直接调用 run_packing 时按不限时处理
+    data = PackingRequestV2(bin_size=[100, 100, 100], items=items)
+    data.time_budget_ms = -1
+    items_out, unpacked, stats = run_packing(data)
+    assert len(items_out) == 5 and not unpacked and "deadline_hit" not in stats
+
+
+def test_bins_used_counts_only_bins_with_placements():
+    # big 放不进任何容器：换出的第二个空容器一件也没装，不计入
+    data = PackingRequestV2(bin_size=[100, 100, 100], max_bins=3, items=[
+        {"name": "a", "w": 10, "h": 10, "d": 10, "count": 5},
+        {"name": "big", "w": 200, "h": 10, "d": 10, "count": 1},
+    ])
+    items, _, stats = run_packing(data)
+    assert {it["bin"] for it in items} == {0}
+    assert stats["bins_used"] == 1
+
+
+def test_session_batches_are_capped():
+    session = PackingSession(owner=1, bin_size=[100, 100, 100], max_batch_units=10)
+    items = PackingRequestV2(bin_size=[100, 100, 100], items=[{"name": "a", "w": 10, "h": 10, "d": 10, "count": 11}]).items
+    with pytest.raises(ValueError, match="会话单批物品过多"):
+        session.add_batch(items)
+    assert not session.batches
+
+
+@pytest.mark.parametrize("items, message", [
+    ([[10, 10, 10, 1e30]], "超出范围"),
+    ([[10, 10, 10, 2 ** 63]], "超出范围"),
+    ([[10, 10, 10, 2 ** 70]], "只能是整数"),
+    ([[10, 10, 10, 1.5]], "只能是整数"),
+    ([[10, 0, 10, 1]], "物品尺寸必须为正数"),
+])
+def test_compact_request_rejects_bad_numbers(items, message):
+    from app.tools.packing.compact import decode_request
+
+    with pytest.raises(ValueError, match=message):
+        decode_request({"bin_size": [100, 100, 100], "names": ["a"], "items": items})
+def test_worker_threads_share_the_cores(monkeypatch):
+    from app.tools.packing import packer as packer_module
+    from app.tools.packing.executor import PackingExecutor
+
+    # 未指定时按进程数均分 CPU 核（不启动进程池）
+    cores = os.cpu_count() or 1
+    assert PackingExecutor(workers=4).threads == max(1, cores // 4)
+    assert PackingExecutor(workers=1).threads == cores
+    assert PackingExecutor(workers=4, threads=3).threads == 3
+
+    # 组合模式：同时运行的策略数与各自的核数合计不超过本线程的内核核数
+    monkeypatch.setattr(packer_module, "kernel_threads", lambda: 2)
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0, "shares": set()}
+    monkeypatch.setattr(packer_module, "set_kernel_threads", lambda n: state["shares"].add(n))
+
+    def pack(name, budget):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.05)
+        with lock:
+            state["running"] -= 1
+        return SmartPacker(4, 4, 4)
+
+    _run_portfolio(pack, "auto", 0)
+    assert state["peak"] <= 2 and state["shares"] == {1}
+
+
+def test_time_budget_counts_queue_time():
+    from app.tools.packing.executor import _Job
+
+    data = PackingRequestV2(
+        bin_size=[100, 100, 100], items=[{"name": "a", "w": 10, "h": 10, "d": 10, "count": 5}], time_budget_ms=2000
+    )
+    # 进程池任务带上按到达时刻算出的截止时刻
+    job = _Job(data, arrived_at=1000.0)
+    try:
+        assert job.meta["deadline"] == 1002.0
+    finally:
+        job.release()
+    # 排队时已用完预算：一件也不放，全部记为 deadline
+    items, unpacked, stats = run_packing(data, deadline_at=time.time() - 0.001)
+    assert not items and stats["deadline_hit"]
+    assert [(u["left"], u["reason"]) for u in unpacked] == [(5, "deadline")]
+    items, _, stats = run_packing(data, deadline_at=time.time() + 60)
+    assert len(items) == 5 and not stats["deadline_hit"]
+
+
+@pytest.fixture(scope="module")
+def executor():
+    from app.tools.packing.executor import PackingExecutor
+
+    executor = PackingExecutor(2, 1)
+    yield executor
+    executor.shutdown()
+
+
+def test_run_many_keeps_order_and_per_job_errors(executor):
+    rng = random.Random(10)
+    jobs = [_random_request(rng) for _ in range(5)]
+    # 件数超限（父进程里就报错）与尺寸为 0（子进程里报错）只影响各自的任务
+    jobs.insert(1, PackingRequestV2(bin_size=[100, 100, 100], items=[{"name": "a", "w": 1, "h": 1, "d": 1, "count": 6000}]))
+    jobs.insert(4, PackingRequestV2(bin_size=[100, 100, 100], items=[{"name": "a", "w": 0, "h": 1, "d": 1, "count": 1}]))
+    results = asyncio.run(executor.run_many(jobs))
+    assert len(results) == len(jobs)
+    for data, result in zip(jobs, results):
+        try:
+            expected = run_packing(data)
+        except ValueError as e:
+            assert isinstance(result, ValueError) and str(result) == str(e)
+        else:
+            assert result[:2] == expected[:2]
+
+
+def test_cache_key_ignores_prefilled_names():
+    from app.tools.packing.cache import request_key
+    from app.tools.packing.compact import decode_request
+
+    items = [{"name": "a", "w": 10, "h": 10, "d": 10, "count": 5}]
+    standard = PackingRequestV2(
+        bin_size=[100, 100, 100], items=items, prefilled=[{"name": "p", "pos": [0, 0, 0], "dim": [50, 10, 50]}]
+    )
+    renamed = standard.model_copy(update={"prefilled": [standard.prefilled[0].model_copy(update={"name": "q"})]})
+    compact = decode_request({
+        "bin_size": [100, 100, 100], "names": ["a"], "items": [[10, 10, 10, 5]], "prefilled": [[0, 0, 0, 50, 10, 50]],
+    })
+    assert request_key(standard) == request_key(renamed) == request_key(compact)
+    moved = standard.model_copy(update={"prefilled": [standard.prefilled[0].model_copy(update={"pos": [50, 0, 0]})]})
+    assert request_key(moved) != request_key(standard)
+
+
+def test_result_cache_coalesces_identical_requests():
+    from app.tools.packing.cache import ResultCache
+
+    result = ([{"name": "a", "pos": [0, 0, 0], "dim": [1, 1, 1]}], [], {})
+
+    async def main():
+        cache = ResultCache(1 << 20, 60)
+        calls = []
+        release = asyncio.Event()
+
+        async def compute():
+            calls.append(1)
+            await release.wait()
+            return result
+
+        first = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(first, second) == [(result, "miss"), (result, "coalesced")]
+        assert len(calls) == 1
+        assert await cache.get_or_compute("k", compute) == (result, "hit")
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("how", ["task_cancelled", "packing_cancelled"])
+def test_result_cache_recomputes_when_first_caller_is_cancelled(how):
+    from app.tools.packing.cache import ResultCache
+    from app.tools.packing.packer import PackingCancelled
+
+    result = ([], [{"name": "a", "left": 1, "total": 1, "reason": "no_space"}], {})
+
+    async def main():
+        cache = ResultCache(1 << 20, 60, retry_on=(PackingCancelled,))
+        calls = []
+        started = asyncio.Event()
+        stop = asyncio.Event()
+
+        async def compute():
+            calls.append(1)
+            if len(calls) == 1:
+                # 先到的请求：客户端断开（任务被取消，或进程池任务抛出 PackingCancelled）
+                started.set()
+                await stop.wait()
+                raise PackingCancelled()
+            return result
+
+        first = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await started.wait()
+        second = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        if how == "task_cancelled":
+            first.cancel()
+        else:
+            stop.set()
+        # 等待者不跟着失败，自己重新计算
+        assert await second == (result, "miss")
+        assert len(calls) == 2
+        with pytest.raises((asyncio.CancelledError, PackingCancelled)):
+            await first
+
+    asyncio.run(main())
+
+
+def test_session_stays_within_store_cap():
+    from app.tools.packing.session import SessionStore
+
+    # 1mm 网格（尺寸互质）：高度场约 4MB，表按原来的上限能建到十几 MB
+    bin_size = [1201, 300, 1199]
+    items = PackingRequestV2(bin_size=bin_size, items=[
+        {"name": f"r{i}", "w": 101 + i, "h": 53, "d": 97, "count": 10} for i in range(4)
+    ]).items
+    store = SessionStore(max_bytes=8 << 20, ttl_s=60)
+    sid, session = store.create(1, bin_size)
+    batch, unpacked, _ = asyncio.run(store.run(session, session.add_batch, items, "prefill"))
+    assert len(batch) == 40 and not unpacked
+    assert session.nbytes <= store.max_bytes
+    # 刚用过的会话不会因自身超限被淘汰
+    assert store.get(1, sid) is session and store.evictions == 0
+
+    # 高度场本身就超出上限：直接报错，会话保持原样
+    small = SessionStore(max_bytes=1 << 20, ttl_s=60)
+    sid, session = small.create(1, bin_size)
+    with pytest.raises(ValueError, match="超出会话内存上限"):
+        asyncio.run(small.run(session, session.add_batch, items, "prefill"))
+    assert not session.batches and small.get(1, sid) is session
+
+
+def test_sessions_per_owner_are_capped():
+    from app.tools.packing.session import SessionStore
+
+    store = SessionStore(max_bytes=1 << 30, ttl_s=60, max_per_owner=2)
+    first, _ = store.create(1, [100, 100, 100])
+    store.create(1, [100, 100, 100])
+    with pytest.raises(ValueError, match="会话数量已达上限"):
+        store.create(1, [100, 100, 100])
+    # 其他用户不受影响；删掉一个之后可以再建
+    store.create(2, [100, 100, 100])
+    assert store.remove(1, first)
+    store.create(1, [100, 100, 100])
+
+
+@pytest.mark.parametrize("options", [{"engine": "sparse"}, {"engine": "extreme_points"}, {"block_mode": True}])
+def test_resume_matches_full_run_for_other_engines(options):
+    rng = random.Random(11)
+    for _ in range(10):
+        data = _random_request(rng, **options)
+        trail = GroupCheckpoints(64 << 20)
+        run_packing(data, trail=trail)
+        changed = data.model_copy(update={"items": data.items[:-1] + [data.items[-1].model_copy(update={"count": 1})]})
+        assert run_packing(changed, resume=trail)[:2] == run_packing(changed)[:2]
+
+
+def test_checkpoints_scale_with_items_not_area():
+    # 1mm 网格的大容器，物品铺满整个底面：检查点只记抬高，不拷贝高度场
+    data = PackingRequestV2(bin_size=[3001, 500, 2999], items=[
+        {"name": f"r{i}", "w": 701 + 2 * i, "h": 31, "d": 699 + 2 * i, "count": 3} for i in range(10)
+    ])
+    trail = GroupCheckpoints(64 << 10)
+    _, _, stats = run_packing(data, trail=trail)
+    assert stats["checkpoint_groups"] == 10 and stats["checkpoint_bytes"] <= 64 << 10
+    # 改最后一组（按体积排序后的最后一组）：前 9 组全部沿用
+    changed = data.model_copy(update={"items": [data.items[0].model_copy(update={"count": 1})] + data.items[1:]})
+    result = run_packing(changed, resume=trail)
+    assert result[2]["resumed_groups"] == 9
+    assert result[:2] == run_packing(changed)[:2]
+
+
+@pytest.mark.parametrize("options", [{}, {"max_bins": 3}, {"portfolio": True}])
+def test_stream_frames_add_up_to_run(executor, options):
+    rng = random.Random(12)
+    data = _random_request(rng, **options)
+
+    async def main():
+        frames = [frame async for frame in executor.stream(data, interval=0.01)]
+        return frames, await executor.run(data)
+
+    frames, expected = asyncio.run(main())
+    assert frames[0] == ("start", sum(it.count for it in data.items))
+    assert frames[-1][0] == "done" and frames[-1][1] == expected[1]
+    streamed = [it for kind, *rest in frames[1:-1] if kind == "items" for it in rest[0]]
+    assert streamed == expected[0]
+
+
+def _decode_binary(blob):
+    """按 encode_binary 的格式解码，展开成逐件摆放（按组的顺序）。"""
+    import json
+    import struct
+
+    from app.tools.packing.compact import BINARY_MAGIC
+
+    assert blob[:4] == BINARY_MAGIC
+    (size,) = struct.unpack("<I", blob[4:8])
+    header = json.loads(blob[8: 8 + size])
+    at = 8 + size
+    arrays = {}
+    for key, n in header["arrays"]:
+        arrays[key] = np.frombuffer(blob, dtype="<i4", count=n, offset=at).tolist()
+        at += 4 * n
+    assert at == len(blob)
+    items = []
+    pos = iter(arrays["pos"])
+    for g, count in enumerate(arrays["group_count"]):
+        for _ in range(count):
+            it = {
+                "name": header["names"][arrays["group_name"][g]],
+                "pos": [next(pos), next(pos), next(pos)],
+                "dim": arrays["group_dim"][3 * g: 3 * g + 3],
+            }
+            if "group_bin" in arrays:
+                it["bin"] = arrays["group_bin"][g]
+            items.append(it)
+    return items, header["unpacked"], header["stats"]
+
+
+@pytest.mark.parametrize("options", [{}, {"max_bins": 3}])
+def test_binary_response_decodes_to_placements(options):
+    from app.tools.packing.compact import encode_binary
+
+    rng = random.Random(13)
+    for _ in range(10):
+        items, unpacked, stats = run_packing(_random_request(rng, **options))
+        decoded, decoded_unpacked, decoded_stats = _decode_binary(encode_binary(items, unpacked, stats))
+        # 组内保持装入顺序，组按第一次出现的顺序排列
+        key = lambda it: (it["name"], it["dim"], it.get("bin"))
+        groups = list(dict.fromkeys(repr(key(it)) for it in items))
+        expected = sorted(items, key=lambda it: groups.index(repr(key(it))))
+        assert decoded == expected
+        assert decoded_unpacked == unpacked and decoded_stats == stats
+
+
+def test_compact_request_matches_standard(executor):
+    from app.tools.packing.compact import decode_request
+
+    rng = random.Random(14)
+    for options in ({}, {"max_bins": 3}, {"tolerance_mm": 7}):
+        data = _random_request(rng, **options)
+        compact = decode_request({
+            "bin_size": data.bin_size,
+            "names": [it.name for it in data.items],
+            "items": [[it.w, it.h, it.d, it.count] for it in data.items],
+            "prefilled": [[*it.pos, *it.dim] for it in data.prefilled],
+            "phase": data.phase,
+            **options,
+        })
+
+        async def main():
+            return await executor.run(compact), await executor.run(data)
+
+        got, expected = asyncio.run(main())
+        assert got[:2] == expected[:2] == run_packing(data)[:2]
+
+